@@ -0,0 +1,146 @@
+"""
+This script trains one Q-Learning agent with several worker processes at once.
+
+Every worker runs its own Spinner and a QAgent whose q_table and n_table are views of arrays in shared memory, so all
+workers learn into the same tables.  Updates are not locked: two workers can update the same entry at the same time
+and one update is lost, which Q-Learning tolerates.  Episodes are numbered through a shared counter, so the wins array
+and the eps_to_zero_at schedule count the episodes of all workers together.  The main process saves a snapshot of the
+tables every snapshot_every seconds while the workers run.
+
+    python AsyncQLearning.py --episodes 20000 --workers 8 --snapshot q_snapshot.npz
+"""
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from multiprocessing import Value, shared_memory
+
+import numpy as np
+
+from Qagent import QAgent
+from Spinner import Spinner
+
+# Shared arrays and episode counter of this process, set by init_worker
+worker_state = None
+
+
+def attach_array(name, shape, dtype=np.float64):
+    """:return: shared memory block and an array view of it"""
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def init_worker(names, table_shape, episodes, counter):
+    global worker_state
+    q_shm, q_table = attach_array(names[0], table_shape)
+    n_shm, n_table = attach_array(names[1], table_shape)
+    w_shm, wins = attach_array(names[2], (episodes,))
+    worker_state = {'blocks': [q_shm, n_shm, w_shm], 'q_table': q_table, 'n_table': n_table, 'wins': wins,
+                    'counter': counter}
+
+
+def run_worker(params, agent_params, seed):
+    """
+    Plays episodes until the shared counter reaches the number of episodes.
+    :return: number of episodes this worker played
+    """
+    agent = QAgent(Spinner(dict(params, seed=seed)), verbose=False, **agent_params)
+    agent.q_table = worker_state['q_table']
+    agent.n_table = worker_state['n_table']
+    wins, counter = worker_state['wins'], worker_state['counter']
+    played = 0
+    while True:
+        with counter.get_lock():
+            i = counter.value
+            counter.value += 1
+        if i >= len(wins):
+            return played
+        # Like QAgent.learn, episode eps_to_zero_at is still played with epsilon and zeroes it once it is done
+        if agent.eps_to_zero_at is not None and i > agent.eps_to_zero_at:
+            agent.epsilon = 0.
+        wins[i] = agent.generate_episode(q_update=True)
+        played += 1
+
+
+def save_snapshot(path, q_table, n_table, episodes_done):
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, q_table=q_table, n_table=n_table, episodes_done=episodes_done)
+    os.replace(tmp_path, path)
+
+
+def train_async(params, episodes, agent_params=None, num_workers=os.cpu_count() or 1, seed=0, snapshot_path=None,
+                snapshot_every=10.):
+    """
+    Trains one agent for episodes episodes spread over num_workers processes, worker w seeded with seed + w.
+    Runs are not reproducible, the order in which workers update the tables depends on timing.
+    :param snapshot_path: .npz file for the periodic snapshots of q_table and n_table, None for no snapshots
+    :return: q_table, n_table and wins, wins[i] is 1 if the i-th episode started was won
+    """
+    agent_params = agent_params or {}
+    game = Spinner(params)
+    table_shape = (game.get_num_states(), game.get_num_actions())
+    table_bytes = int(np.prod(table_shape)) * np.dtype(np.float64).itemsize
+    blocks = [shared_memory.SharedMemory(create=True, size=size)
+              for size in [table_bytes, table_bytes, episodes * np.dtype(np.float64).itemsize]]
+    try:
+        q_table = np.ndarray(table_shape, dtype=np.float64, buffer=blocks[0].buf)
+        n_table = np.ndarray(table_shape, dtype=np.float64, buffer=blocks[1].buf)
+        wins = np.ndarray((episodes,), dtype=np.float64, buffer=blocks[2].buf)
+        q_table[:] = 0.
+        n_table[:] = 0.
+        wins[:] = 0.
+        counter = Value('q', 0)
+
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                                 initargs=([b.name for b in blocks], table_shape, episodes, counter)) as pool:
+            futures = [pool.submit(run_worker, params, agent_params, seed + w) for w in range(num_workers)]
+            pending = futures
+            while pending:
+                done, pending = wait(pending, timeout=snapshot_every, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()
+                if snapshot_path is not None:
+                    save_snapshot(snapshot_path, q_table, n_table, min(counter.value, episodes))
+
+        return q_table.copy(), n_table.copy(), wins.copy()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Asynchronous multi-process Q-Learning on a shared Q-table')
+    parser.add_argument('--episodes', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--alpha', type=float, default=0.3)
+    parser.add_argument('--epsilon', type=float, default=0.2)
+    parser.add_argument('--gamma', type=float, default=0.93)
+    parser.add_argument('--eps-to-zero-at', type=int, default=750)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--snapshot', help='.npz file for periodic snapshots of the tables')
+    parser.add_argument('--snapshot-every', type=float, default=10., help='seconds between snapshots')
+    args = parser.parse_args()
+
+    params = {'max_pips': 9,
+              'spinners': False,
+              'allow_chickenfeet': False,
+              'initial_hand_size': 7,
+              'end_round': 0,
+              'state_type': 'two_exposed_ends',
+              'action_space_type': 'hl',
+              'players': [{'id': 0, 'strategy': 'agent', 'verbose': False},
+                          {'id': 1, 'strategy': 'random', 'verbose': False}],
+              'verbose': False}
+    agent_params = {'alpha': args.alpha, 'epsilon': args.epsilon, 'gamma': args.gamma,
+                    'eps_to_zero_at': args.eps_to_zero_at}
+    start = time.perf_counter()
+    q_table, n_table, wins = train_async(params, args.episodes, agent_params, args.workers, args.seed, args.snapshot,
+                                         args.snapshot_every)
+    print(f'Trained {args.episodes} episodes on {args.workers} workers in {time.perf_counter() - start:.1f}s')
+    print(f'Win rate over the last 100 episodes: {wins[-100:].mean():.3f}')
+    print(f'States visited: {int((n_table.sum(axis=1) > 0).sum())} of {len(n_table)}')
+
+
+if __name__ == '__main__':
+    main()
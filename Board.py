@@ -2,18 +2,68 @@
 
 
 class Board:
+    """
+    Attributes:
+        tiles: tiles on the board in the order they were played
+        end_values: every end value, 0 to max_pips then 'S'
+        end_slot: dict from end value to its position in end_values
+        end_counts: number of exposed ends of each value, by slot.  exposed_ends is derived from it.
+        end_mask: bit i set when end_counts[i] > 0
+        exposed_double, exposed_double_count: double waiting for tiles_per_double tiles, and the tiles played on it
+        version: changes whenever the board changes, used by players to cache valid plays
+    """
+
     def __init__(self, game, allow_chickenfeet=False):
         self.game = game
         self.tiles = []
-        self.exposed_ends = []
+        self.end_values = list(range(game.max_pips + 1)) + ['S']
+        self.end_slot = {v: i for i, v in enumerate(self.end_values)}
+        self.end_counts = [0] * len(self.end_values)
+        self.end_mask = 0
+        # get_usable_exposed_ends returns these shared tuples, so it never allocates once every mask has been seen
+        self.ends_by_mask = {0: ()}
+        self.single_ends = {v: (v,) for v in self.end_values}
         self.exposed_double = None
         self.exposed_double_count = 0
         self.allow_chickenfeet = allow_chickenfeet
         self.tiles_per_double = 3 if allow_chickenfeet else 1
+        self.version = 0
+
+    @property
+    def exposed_ends(self) -> list:
+        """Exposed ends as a list ordered by end value, built on each call.  The game itself reads end_counts."""
+        return [v for v, count in zip(self.end_values, self.end_counts) for _ in range(count)]
+
+    @exposed_ends.setter
+    def exposed_ends(self, ends):
+        counts = [0] * len(self.end_values)
+        for e in ends:
+            counts[self.end_slot[e]] += 1
+        self.set_end_counts(counts)
+
+    def set_end_counts(self, counts) -> None:
+        self.end_counts = list(counts)
+        self.end_mask = sum(1 << i for i, count in enumerate(counts) if count)
+
+    def add_end(self, value) -> None:
+        slot = self.end_slot[value]
+        self.end_counts[slot] += 1
+        self.end_mask |= 1 << slot
+
+    def remove_end(self, value) -> None:
+        slot = self.end_slot[value]
+        count = self.end_counts[slot]
+        if count == 0:
+            raise Exception(f'Board.remove_end error, no exposed end {value} in exposed_ends {self.exposed_ends}')
+        self.end_counts[slot] = count - 1
+        if count == 1:
+            self.end_mask &= ~(1 << slot)
 
     def reset_for_new_round(self):
+        self.version += 1
         self.tiles = []
-        self.exposed_ends = []
+        self.end_counts = [0] * len(self.end_values)
+        self.end_mask = 0
         self.exposed_double = None
         self.exposed_double_count = 0
 
@@ -22,12 +72,23 @@ class Board:
         # TODO discuss if we need to account for tile played with spinner exposed, this is legal but unwise
         # TODO discuss action space for playing spinner, needs to also include which end spinner is being played
 
+        stats = self.game.instrumentation
+        if stats is not None:
+            start = stats.timer()
+        zobrist = self.game.zobrist
+        if zobrist is not None:
+            old_double, old_double_count = self.exposed_double, self.exposed_double_count
+            zobrist.toggle_board_tile(tile)
+        self.version += 1
         if len(self.tiles) == 0:
             r = self.game.round
             if (tile.low, tile.high) not in [(r, r), ('S', 'S')]:
                 raise Exception(f'Receive tile error, first tile must be {r}|{r} or S|S, not {tile}')
             self.tiles.append(tile)
-            self.exposed_ends = [r, r]
+            self.add_end(r)
+            self.add_end(r)
+            if zobrist is not None:
+                zobrist.change_ends([], [r, r])
 
         elif len(self.tiles) in [1, 2]:
             r = self.game.round
@@ -43,7 +104,10 @@ class Board:
                 )
             self.add_tile_adjust_exposed_ends(tile, end_value)
             if len(self.tiles) == 3 and self.allow_chickenfeet:
-                self.exposed_ends += [r, r]
+                if zobrist is not None:
+                    zobrist.change_ends(self.exposed_ends, self.exposed_ends + [r, r])
+                self.add_end(r)
+                self.add_end(r)
 
         else:  # fourth tile or later
             if self.exposed_double:
@@ -68,12 +132,17 @@ class Board:
                 self.tiles.append(tile)
 
             else:
-                if end_value not in self.exposed_ends:
+                if self.end_counts[self.end_slot[end_value]] == 0:
                     raise Exception(f'Board.receive_tile error.'
                                     f'Cannot add tile to board if exposed end {end_value} not '
                                     f'in exposed_ends {self.exposed_ends}')
                 self.add_tile_adjust_exposed_ends(tile, end_value)
 
+        if zobrist is not None:
+            zobrist.change_double(old_double, old_double_count, self.exposed_double, self.exposed_double_count)
+        if stats is not None:
+            stats.record('place_tile', stats.timer() - start)
+
     def add_tile_adjust_exposed_ends(self, tile, end_value) -> None:
         # TODO needs to address exposed doubles = True, can't remove double value from exposed ends
         self.tiles.append(tile)
@@ -82,25 +151,34 @@ class Board:
                 f'Board.receive_tile error. add_tile_adjust_exposed_ends cannot receive double.  tile={tile}\n'
                 f'exposed_double={self.exposed_double}')
         elif tile.is_spinner:
-            self.exposed_ends.remove(end_value)
-            self.exposed_ends.append(tile.low)
+            removed, added = end_value, tile.low
+        elif end_value == tile.low:
+            removed, added = tile.low, tile.high
         else:
-            if end_value == tile.low:
-                self.exposed_ends.remove(tile.low)
-                self.exposed_ends.append(tile.high)
-            else:
-                self.exposed_ends.remove(tile.high)
-                self.exposed_ends.append(tile.low)
+            removed, added = tile.high, tile.low
+        self.remove_end(removed)
+        self.add_end(added)
+        if self.game.zobrist is not None:
+            counts, slot = self.end_counts, self.end_slot
+            self.game.zobrist.replace_end(removed, counts[slot[removed]], added, counts[slot[added]])
 
-    def get_usable_exposed_ends(self) -> list:
+    def get_usable_exposed_ends(self) -> tuple:
+        """
+        :return: distinct end values a tile can be played on, in end value order.  The tuple is shared, do not modify.
+        """
         if self.exposed_double:
-            return [self.exposed_double]
-        if len(self.tiles) == 0:
-            return []
-        if len(self.tiles) in [1, 2]:
-            return [self.game.round]
-        else:
-            return sorted(list(set(self.exposed_ends)))
+            return self.single_ends[self.exposed_double]
+        num_tiles = len(self.tiles)
+        if num_tiles == 0:
+            return ()
+        if num_tiles <= 2:
+            return self.single_ends[self.game.round]
+        mask = self.end_mask
+        ends = self.ends_by_mask.get(mask)
+        if ends is None:
+            ends = tuple(v for i, v in enumerate(self.end_values) if mask >> i & 1)
+            self.ends_by_mask[mask] = ends
+        return ends
 
     def __str__(self):
         return (f'Board Tiles: {" ".join(map(str, self.tiles))}\n'
@@ -0,0 +1,192 @@
+"""
+This script contains the exact endgame solver used by the 'endgame' Player strategy.
+
+Once the boneyard is empty nothing more is drawn, so the rest of the round is a finite game of perfect information
+decided by the hands and the board.  EndgameSolver searches it with alpha-beta on the game itself and undoes each
+move, so every rule of Board applies.  A player with no valid play passes, and the round ends
+as in Spinner.is_round_done.
+
+The value of a position is the round score of the player the search was started for, less the mean round score of
+the other players.  That player minimizes it and the others maximize it, so with more than two players the others
+are assumed to play against the searching player.  Positions are memoized on their Zobrist hash in a bounded LRU
+table, and the best play found for a position is tried first when it is searched again.  The 'endgame' strategy
+clears the table when a new game starts, so a game does not depend on the games played before it.
+
+    solver = EndgameSolver()
+    play, value = solver.solve(game)
+"""
+import math
+import time
+from collections import OrderedDict
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class NodeLimitReached(Exception):
+    pass
+
+
+class EndgameSolver:
+    """
+    Attributes:
+        max_entries: size of the memo table, the least recently used position is dropped first
+        max_nodes: positions a solve may visit before it gives up, None for no limit
+        memo: OrderedDict from (root seat, position hash) to (value, bound, best play)
+        solves, aborted: number of solve calls that finished or gave up
+        nodes, memo_hits, evictions: positions searched, found in the memo table, and dropped from it
+        seconds: total time spent in solve
+    """
+
+    def __init__(self, max_entries=1_000_000, max_nodes=100_000):
+        self.max_entries = max_entries
+        self.max_nodes = max_nodes
+        self.memo = OrderedDict()
+        self.game = None
+        self.root_seat = None
+        self.node_budget = None
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.solves = 0
+        self.aborted = 0
+        self.nodes = 0
+        self.memo_hits = 0
+        self.evictions = 0
+        self.seconds = 0.
+
+    def stats(self) -> dict:
+        calls = self.solves + self.aborted
+        return {'solves': self.solves,
+                'aborted': self.aborted,
+                'nodes': self.nodes,
+                'memo_hits': self.memo_hits,
+                'memo_hit_rate': self.memo_hits / max(self.nodes, 1),
+                'memo_size': len(self.memo),
+                'evictions': self.evictions,
+                'seconds': self.seconds,
+                'mean_ms': 1e3 * self.seconds / calls if calls else 0.}
+
+    def clear(self) -> None:
+        self.memo.clear()
+
+    def solve(self, game):
+        """
+        Finds the best play of the current player.  The game is searched in place and left as it was.
+        :param game: Spinner with an empty boneyard, in a round that is not over
+        :return: (best valid play, value of the position), the play is None if the current player has to pass.
+                 (None, None) if the search visited max_nodes positions without finishing.
+        """
+        if len(game.boneyard) > 0:
+            raise Exception(f'EndgameSolver.solve needs an empty boneyard, {len(game.boneyard)} tiles left')
+        if game.round_done:
+            raise Exception('EndgameSolver.solve called on a finished round')
+        start = time.perf_counter()
+        hashing = game.zobrist is not None
+        if not hashing:
+            game.enable_hashing()
+        stats, game.instrumentation = game.instrumentation, None
+        snapshot = game.snapshot(include_rng=False)
+        self.game = game
+        self.root_seat = game.current_player.id
+        self.node_budget = self.nodes + self.max_nodes if self.max_nodes is not None else None
+        try:
+            value, play = self.search(-math.inf, math.inf)
+            self.solves += 1
+        except NodeLimitReached:
+            value, play = None, None
+            self.aborted += 1
+        finally:
+            game.restore(snapshot)
+            game.instrumentation = stats
+            if not hashing:
+                game.disable_hashing()
+            self.game = None
+            self.seconds += time.perf_counter() - start
+        return play, value
+
+    def search(self, alpha, beta):
+        """:return: value of the game's position and the best play of its current player"""
+        game = self.game
+        self.nodes += 1
+        if self.node_budget is not None and self.nodes > self.node_budget:
+            raise NodeLimitReached()
+        key = (self.root_seat, game.zobrist.value)
+        entry = self.memo.get(key)
+        first = None
+        if entry is not None:
+            self.memo_hits += 1
+            self.memo.move_to_end(key)
+            value, bound, first = entry
+            if bound == EXACT:
+                return value, first
+            if bound == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, first
+
+        player = game.current_player
+        maximize = player.id != self.root_seat
+        plays = player.get_valid_plays()
+        if plays:
+            # high tiles first, they change the score the most, after the best play of an earlier search
+            hand = player.hand
+            plays = sorted(plays, key=lambda p: (p != first, -hand[p[0]].value))
+        else:
+            plays = [None]  # pass
+
+        alpha_0, beta_0 = alpha, beta
+        best_value, best_play = (-math.inf if maximize else math.inf), None
+        for play in plays:
+            saved = self.save(player)
+            if play is not None:
+                player.place_tile_from_hand(play)
+            if game.is_round_done():
+                value = self.round_value()
+            else:
+                game.next_player()
+                value, _ = self.search(alpha, beta)
+            self.undo(player, saved)
+            if (value > best_value) if maximize else (value < best_value):
+                best_value, best_play = value, play
+            if maximize:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= alpha_0:
+            bound = UPPER
+        elif best_value >= beta_0:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.memo[key] = (best_value, bound, best_play)
+        if len(self.memo) > self.max_entries:
+            self.memo.popitem(last=False)
+            self.evictions += 1
+        return best_value, best_play
+
+    def save(self, player):
+        # Only the board, the hand of the player to move and the player to move change in a move, saving just these
+        # is much cheaper than Spinner.snapshot
+        game, board = self.game, self.game.board
+        return (len(board.tiles), tuple(board.end_counts), board.end_mask, board.exposed_double,
+                board.exposed_double_count, player.snapshot_hand(), game.zobrist.value)
+
+    def undo(self, player, saved):
+        game, board = self.game, self.game.board
+        num_tiles, end_counts, board.end_mask, board.exposed_double, board.exposed_double_count, hand, zobrist = saved
+        del board.tiles[num_tiles:]
+        board.end_counts = list(end_counts)
+        game.zobrist.value = zobrist
+        board.version += 1  # never back to an old version, players may have cached valid plays for it
+        player.restore_hand(hand)
+        game.current_player = player
+
+    def round_value(self):
+        scores = [p.get_score() for p in self.game.players]
+        own = scores.pop(self.root_seat)
+        return own - sum(scores) / len(scores)
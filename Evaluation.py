@@ -0,0 +1,219 @@
+"""
+This script evaluates trained Q-tables by playing their greedy policy against the opponents in params.
+
+Game g of an evaluation is played after seeding the Spinner with seed + g, so every policy evaluated with the
+same seed gets the same deals and starting players (common random numbers).  Comparing two policies on the same games
+cancels most of the luck of the deal: only the games one policy wins and the other loses (discordant pairs) carry
+information about which is better.
+
+Games are played in rounds of num_workers batches.  After every round the running result is tested and the evaluation
+stops as soon as it is settled:
+    evaluate: the confidence interval of the win rate is narrower than precision
+    compare: a sequential probability ratio test on the discordant pairs picks a winner
+The test only looks at complete rounds, so the result does not depend on the timing of the workers.
+
+    python Evaluation.py agent_a.npy agent_b.npy --max-games 20000
+"""
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from Spinner import Spinner
+
+# Spinner owned by this process, created once per worker by init_worker
+worker_game = None
+
+
+def init_worker(params):
+    global worker_game
+    worker_game = Spinner(params)
+
+
+def greedy_actions(q_table):
+    """Greedy action of every state.  Ties go to the lowest action so the policy uses no random numbers."""
+    return np.asarray(q_table).argmax(axis=1)
+
+
+def play_games(policies, seeds):
+    """
+    Plays every policy on every seed with this process's Spinner.
+    :param policies: list of greedy action arrays, one entry per state
+    :return: (len(policies), len(seeds)) array, 1 for the games won
+    """
+    game = worker_game
+    wins = np.zeros((len(policies), len(seeds)))
+    for p, actions in enumerate(policies):
+        for g, seed in enumerate(seeds):
+            game.seed(seed)
+            state, reward, done = game.reset()
+            while not done:
+                state, reward, done = game.execute_action(int(actions[state]))
+            wins[p, g] = reward == 100
+    return wins
+
+
+def wilson_interval(wins, games, z=1.96):
+    """:return: lower and upper bound of the Wilson score interval for a win rate"""
+    if games == 0:
+        return 0., 1.
+    rate = wins / games
+    centre = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    half = z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return float(centre - half), float(centre + half)
+
+
+class Evaluation(NamedTuple):
+    games: int
+    win_rate: float
+    interval: tuple
+
+
+class Comparison(NamedTuple):
+    games: int
+    win_rates: tuple
+    intervals: tuple
+    difference: float  # win rate of a minus win rate of b
+    difference_interval: tuple
+    discordant: tuple  # games won by a only, games won by b only
+    winner: str  # 'a', 'b', or None if no decision was reached within max_games
+
+
+def run_rounds(params, policies, seed, batch_size, num_workers, max_games, settled):
+    """
+    Plays rounds of num_workers batches of batch_size seeds until settled(wins) is True or max_games are played.
+    :return: (len(policies), games) wins array
+    """
+    results = []
+    played = 0
+    pool = ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=(params,)) \
+        if num_workers > 1 else None
+    try:
+        if pool is None:
+            init_worker(params)
+        while played < max_games:
+            batches = []
+            for w in range(num_workers):
+                start = played + w * batch_size
+                end = min(start + batch_size, max_games)
+                if start < end:
+                    batches.append(list(range(seed + start, seed + end)))
+            if pool is None:
+                results.extend(play_games(policies, b) for b in batches)
+            else:
+                results.extend(pool.map(play_games, [policies] * len(batches), batches))
+            played = min(played + num_workers * batch_size, max_games)
+            if settled(np.concatenate(results, axis=1)):
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return np.concatenate(results, axis=1)
+
+
+def evaluate(params, q_table, max_games=10000, precision=0.01, seed=0, batch_size=200, num_workers=1, z=1.96):
+    """
+    Win rate of the greedy policy of q_table.
+    :param precision: stop once the half width of the confidence interval is below this, None to play max_games
+    """
+    def settled(wins):
+        if precision is None:
+            return False
+        low, high = wilson_interval(wins.sum(), wins.shape[1], z)
+        return (high - low) / 2 < precision
+
+    wins = run_rounds(params, [greedy_actions(q_table)], seed, batch_size, num_workers, max_games, settled)[0]
+    return Evaluation(len(wins), float(wins.mean()), wilson_interval(wins.sum(), len(wins), z))
+
+
+def sprt_decision(a_only, b_only, delta=0.1, alpha=0.05, beta=0.05):
+    """
+    Wald's sequential probability ratio test on the discordant pairs.  Among the games won by exactly one policy, a
+    wins with probability p.  The test is between p = 0.5 + delta and p = 0.5 - delta.
+    :return: 'a', 'b', or None to keep playing
+    """
+    llr = (a_only - b_only) * math.log((0.5 + delta) / (0.5 - delta))
+    if llr >= math.log((1 - beta) / alpha):
+        return 'a'
+    if llr <= math.log(beta / (1 - alpha)):
+        return 'b'
+    return None
+
+
+def compare(params, q_table_a, q_table_b, max_games=20000, delta=0.1, alpha=0.05, seed=0, batch_size=200,
+            num_workers=1, z=1.96):
+    """
+    Compares the greedy policies of two Q-tables on the same games and stops once the SPRT picks one.
+    :param delta: smallest edge worth detecting, as the probability above 0.5 of winning a discordant pair
+    :param alpha: error rate of the test, in both directions
+    """
+    def settled(wins):
+        a_only = int((wins[0] > wins[1]).sum())
+        b_only = int((wins[1] > wins[0]).sum())
+        return sprt_decision(a_only, b_only, delta, alpha, alpha) is not None
+
+    policies = [greedy_actions(q_table_a), greedy_actions(q_table_b)]
+    wins = run_rounds(params, policies, seed, batch_size, num_workers, max_games, settled)
+    games = wins.shape[1]
+    a_only = int((wins[0] > wins[1]).sum())
+    b_only = int((wins[1] > wins[0]).sum())
+    diff = wins[0] - wins[1]
+    half = z * diff.std(ddof=1) / math.sqrt(games) if games > 1 else math.inf
+    return Comparison(games,
+                      (float(wins[0].mean()), float(wins[1].mean())),
+                      (wilson_interval(wins[0].sum(), games, z), wilson_interval(wins[1].sum(), games, z)),
+                      float(diff.mean()),
+                      (float(diff.mean() - half), float(diff.mean() + half)),
+                      (a_only, b_only),
+                      sprt_decision(a_only, b_only, delta, alpha, alpha))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate or compare greedy policies of saved Q-tables (.npy)')
+    parser.add_argument('q_tables', nargs='+', help='one Q-table to evaluate, or two to compare')
+    parser.add_argument('--opponents', nargs='+', default=['random'], help='strategies of the other seats')
+    parser.add_argument('--state-type', choices=['two_exposed_ends', 'one_state'], default='two_exposed_ends')
+    parser.add_argument('--action-space', default='hl')
+    parser.add_argument('--end-round', type=int, default=0)
+    parser.add_argument('--max-games', type=int, default=20000)
+    parser.add_argument('--precision', type=float, default=0.01, help='target half width when evaluating one table')
+    parser.add_argument('--delta', type=float, default=0.1, help='indifference zone of the comparison test')
+    parser.add_argument('--alpha', type=float, default=0.05, help='error rate of the comparison test')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    if len(args.q_tables) > 2:
+        parser.error('give one or two Q-tables')
+
+    params = {'max_pips': 9,
+              'spinners': False,
+              'allow_chickenfeet': False,
+              'initial_hand_size': 7,
+              'end_round': args.end_round,
+              'state_type': args.state_type,
+              'action_space_type': args.action_space,
+              'players': [{'id': 0, 'strategy': 'agent', 'verbose': False}] +
+                         [{'id': i + 1, 'strategy': s, 'verbose': False} for i, s in enumerate(args.opponents)],
+              'verbose': False}
+    tables = [np.load(path) for path in args.q_tables]
+    if len(tables) == 1:
+        result = evaluate(params, tables[0], args.max_games, args.precision, args.seed, args.batch_size, args.workers)
+        print(f'Win rate {result.win_rate:.4f} [{result.interval[0]:.4f}, {result.interval[1]:.4f}] '
+              f'over {result.games} games')
+    else:
+        result = compare(params, tables[0], tables[1], args.max_games, args.delta, args.alpha, args.seed,
+                         args.batch_size, args.workers)
+        for name, rate, (low, high) in zip(args.q_tables, result.win_rates, result.intervals):
+            print(f'{name}: win rate {rate:.4f} [{low:.4f}, {high:.4f}]')
+        low, high = result.difference_interval
+        print(f'Difference {result.difference:+.4f} [{low:+.4f}, {high:+.4f}] over {result.games} games, '
+              f'discordant games {result.discordant[0]} vs {result.discordant[1]}')
+        print(f'Better policy: {args.q_tables[0 if result.winner == "a" else 1] if result.winner else "undecided"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+This script contains the compact binary record format for Spinner games.
+
+A game is replayed by the engine itself: Spinner deals every round and picks every starting player from the game's
+deal_seed, and draws and turns with a single valid play are forced, so a record only holds the deal seed and the
+index of the chosen play in Player.get_valid_plays for every turn with two or more valid plays.
+
+Records do not spell out each move (player, tile, end value, draw or pass), which would take about 1.65 KB per game.
+The price is that a record can only be decoded by an engine that deals, orders valid plays and picks starting players
+exactly like the one that wrote it.  Each game therefore carries Spinner.REPLAY_VERSION and a checksum of its first
+deal, and replay_game rejects a record whose version or first deal does not match the engine, rather than replaying
+it into a different game.
+
+A record file starts with MAGIC, whose last byte is the format version, and holds any number of games appended one
+after another, each made of
+    MARK GAME_START  deal seed (u64), first deal checksum (u32), engine version, max_pips,
+                     flags (1 spinners, 2 chickenfeet), hand size, end round, players
+    one byte per choice, 0 to 254
+    MARK GAME_END    score total of each player (u16 each, little-endian)
+A ten round game (max_pips 9) takes about 280 bytes, 130 with gzip compression.  Games are written whole when they
+end, so the writer holds one game at a time and a file only ends in a partial game if the process died mid-write.
+"""
+import gzip
+import os
+import struct
+import zlib
+from typing import NamedTuple
+
+from Spinner import REPLAY_VERSION
+
+MAGIC = b'SPNR\x03'
+
+MARK = 0xFF  # starts a control, choices are smaller
+GAME_START, GAME_END = 0, 1
+
+GAME_START_PAYLOAD = struct.Struct('<QIBBBBBB')
+
+
+class GameRecord(NamedTuple):
+    deal_seed: int
+    deal_checksum: int  # see deal_checksum
+    engine_version: int  # Spinner.REPLAY_VERSION of the engine that played the game
+    max_pips: int
+    spinners: bool
+    allow_chickenfeet: bool
+    initial_hand_size: int
+    end_round: int
+    num_players: int
+    choices: bytes  # index of the chosen valid play of each turn with two or more valid plays
+    score_totals: list
+
+
+def deal_checksum(game) -> int:
+    """:return: CRC-32 of the tile ids of every hand and of the boneyard, in order"""
+    ids = [t.id for p in game.players for t in p.hand]
+    ids += [t.id for t in game.boneyard]
+    return zlib.crc32(bytes(ids))
+
+
+class GameRecordWriter:
+    """
+    Streams games to a record file as they are played.  Attach it to a Spinner with attach(); Spinner.deal,
+    Player.play_turn and Spinner.end_turn then call the record_ methods.
+    Attributes:
+        games_written: number of complete games written
+        game: bytes of the game being played, written to the (buffered) file when it ends
+    """
+
+    def __init__(self, path, compress=False):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = gzip.open(path, 'ab') if compress else open(path, 'ab')
+        if new_file:
+            self.file.write(MAGIC)
+        self.games_written = 0
+        self.game = None
+
+    def attach(self, game):
+        """Starts recording every game played by game, from its next reset()."""
+        game.recorder = self
+
+    def record_deal(self, game):
+        if game.round != game.starting_round:
+            return
+        flags = game.spinners | game.allow_chickenfeet << 1
+        self.game = bytearray((MARK, GAME_START))
+        self.game += GAME_START_PAYLOAD.pack(game.deal_seed, deal_checksum(game), REPLAY_VERSION, game.max_pips, flags,
+                                             game.init_hand_size, game.ending_round, len(game.players))
+
+    def record_choice(self, valid_plays, play):
+        if self.game is None:
+            return
+        index = valid_plays.index(play)  # equal plays in valid_plays are the same move
+        if index >= MARK:
+            raise Exception(f'GameRecordWriter supports at most {MARK} valid plays, got {len(valid_plays)}')
+        self.game.append(index)
+
+    def record_game_end(self, game):
+        if self.game is None:
+            return
+        totals = game.calc_score_totals()
+        self.game += bytes((MARK, GAME_END))
+        self.game += struct.pack(f'<{len(totals)}H', *(int(t) for t in totals))
+        self.file.write(self.game)
+        self.game = None
+        self.games_written += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameRecordReader:
+    """
+    Iterates over the complete games in a record file, one GameRecord at a time.  Games that were cut off (no
+    GAME_END) are skipped.  Plain and gzip compressed files are both read.
+    """
+
+    def __init__(self, path, chunk_size=1 << 20):
+        with open(path, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        self.file = gzip.open(path, 'rb') if compressed else open(path, 'rb')
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.pos = 0
+        magic = self.read(len(MAGIC))
+        if magic[:-1] != MAGIC[:-1]:
+            raise Exception(f'{path} is not a Spinner game record file')
+        if magic != MAGIC:
+            raise Exception(f'{path} is a version {magic[-1]} Spinner game record file, only version {MAGIC[-1]} '
+                            f'can be read')
+
+    def fill(self) -> bool:
+        """Appends the next chunk of the file to the buffer.  :return: False at the end of the file"""
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return len(chunk) > 0
+
+    def read(self, n):
+        while self.pos + n > len(self.buffer):
+            if not self.fill():
+                raise EOFError
+        data = self.buffer[self.pos:self.pos + n]
+        self.pos += n
+        return data
+
+    def read_until_mark(self):
+        """:return: the bytes up to the next MARK, which is consumed"""
+        start = self.pos
+        while (i := self.buffer.find(MARK, start)) < 0:
+            start = len(self.buffer) - self.pos
+            if not self.fill():
+                raise EOFError
+            start += self.pos
+        data = self.buffer[self.pos:i]
+        self.pos = i + 1
+        return data
+
+    def __iter__(self):
+        header = None
+        while True:
+            try:
+                choices = self.read_until_mark()
+                control = self.read(1)[0]
+                if control == GAME_START:
+                    header = GAME_START_PAYLOAD.unpack(self.read(GAME_START_PAYLOAD.size))
+                    continue
+                if control != GAME_END:
+                    raise Exception(f'Invalid control {control} in game record file')
+                if header is None:
+                    raise Exception('GAME_END without GAME_START in game record file')
+                totals = struct.unpack(f'<{header[-1]}H', self.read(2 * header[-1]))
+            except EOFError:
+                return
+            deal_seed, checksum, engine_version, max_pips, flags, hand_size, end_round, num_players = header
+            yield GameRecord(deal_seed, checksum, engine_version, max_pips, bool(flags & 1), bool(flags & 2),
+                             hand_size, end_round, num_players, choices, list(totals))
+            header = None
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def replay_params(record):
+    """Spinner params that can replay record.  Every seat is 'human', so replay_game can hand it the recorded choices."""
+    return {'max_pips': record.max_pips,
+            'spinners': record.spinners,
+            'allow_chickenfeet': record.allow_chickenfeet,
+            'initial_hand_size': record.initial_hand_size,
+            'end_round': record.end_round,
+            'state_type': 'one_state',
+            'action_space_type': 'hl',
+            'players': [{'id': i, 'strategy': 'human', 'verbose': False} for i in range(record.num_players)],
+            'verbose': False}
+
+
+def replay_game(record, game):
+    """
+    Plays a recorded game through game, which must have been built with replay_params(record) or equivalent params.
+    The game deals from record.deal_seed and plays the forced turns, each recorded choice picks the play of the next
+    turn with two or more valid plays.  Records of another engine version, or whose first deal the game does not
+    reproduce, are rejected.
+    :return: score totals of the replayed game, equal to record.score_totals
+    """
+    if record.engine_version != REPLAY_VERSION:
+        raise Exception(f'Replay error, record made by engine version {record.engine_version}, this engine replays '
+                        f'version {REPLAY_VERSION}')
+    game.new_game(record.deal_seed)
+    if deal_checksum(game) != record.deal_checksum:
+        raise Exception(f'Replay error, deal seed {record.deal_seed} does not deal the recorded first round')
+    choices = iter(record.choices)
+    while not game.game_done:
+        player = game.current_player
+        choice = None
+        if len(player.get_valid_plays()) >= 2:
+            choice = next(choices, None)
+            if choice is None:
+                raise Exception(f'Replay error, record ended in round {game.round} before the game did')
+        player.play_turn(choice)
+        game.end_turn()
+    if next(choices, None) is not None:
+        raise Exception('Replay error, the game ended before the recorded choices did')
+
+    totals = [int(t) for t in game.calc_score_totals()]
+    if totals != list(record.score_totals):
+        raise Exception(f'Replay error, score totals {totals} do not match record {record.score_totals}')
+    return totals
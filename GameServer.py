@@ -0,0 +1,495 @@
+"""
+This script contains an asyncio server that hosts many Spinner tables in one process, and a load generator for it.
+
+Clients speak a line protocol over TCP, one JSON object per line.  A client opens a table by naming every seat:
+    {"type": "new_table", "seats": ["remote", "policy:agent"], "seed": 7, "params": {"end_round": 5}}
+'remote' seats are played by the client, 'policy:<name>' seats by a Q-policy loaded with --policy name=path.npy, and
+the other Player strategies ('random', 'play_high', 'play_low', 'lookahead', 'endgame') are played by the server.
+The server answers
+    {"type": "joined", "table": 3, "seats": [0]}
+and, whenever a remote seat has more than one valid play,
+    {"type": "turn", "table": 3, "seat": 0, "round": 9, "board": ["9|9", "4|9"], "ends": [4, 9],
+     "hand": ["2|9", "4|6"], "plays": [["2|9", 9], ["4|6", 4]]}
+to which the client replies with the index of its play
+    {"type": "play", "table": 3, "choice": 1}
+The game ends with {"type": "game_over", "table": 3, "scores": [...], "winners": [0]}, and a request the server cannot
+serve is answered with {"type": "error", "message": ...}.  One connection can play any number of tables at once.
+
+Each table is a task.  Remote seats are 'human' Players whose choice is awaited from the connection, and bot seats are
+played inline.  Q-policy seats are 'agent' Players.  The states they look up from every table in the same pass of
+the event loop are answered together, with one argmax per policy.
+
+    python GameServer.py serve --port 8765 --policy agent=agent.npy
+    python GameServer.py load --port 8765 --tables 2000 --connections 20 --seats remote policy:agent
+    python GameServer.py bench --tables 2000 --seats remote random
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from Spinner import ACTION_KEYS, Spinner
+
+BASE_PARAMS = {'max_pips': 9,
+               'spinners': False,
+               'allow_chickenfeet': False,
+               'initial_hand_size': 7,
+               'end_round': 0,
+               'state_type': 'two_exposed_ends',
+               'action_space_type': 'hl',
+               'verbose': False}
+
+BOT_STRATEGIES = ['random', 'play_high', 'play_low', 'lookahead', 'endgame']
+TABLE_PARAMS = ['max_pips', 'spinners', 'initial_hand_size', 'end_round']  # params a client may set for its table
+
+
+def percentiles(samples, qs=(50, 90, 99)) -> dict:
+    if not samples:
+        return {f'p{q}': math.nan for q in qs}
+    values = np.percentile(np.fromiter(samples, dtype=float), qs)
+    return {f'p{q}': float(v) for q, v in zip(qs, values)}
+
+
+class PolicyBatcher:
+    """
+    Greedy actions of Q-policies for the states sent by many tables.  Requests made in one pass of the event loop are
+    answered together, with one argmax over the stacked q_table rows of each policy.
+    Attributes:
+        q_tables: dict from policy name to its q_table
+        batches, requests: number of batches run and of states looked up
+    """
+
+    def __init__(self, q_tables):
+        self.q_tables = q_tables
+        self.pending = {}
+        self.scheduled = False
+        self.batches = 0
+        self.requests = 0
+
+    def action(self, name, state) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(name, []).append((state, future))
+        if not self.scheduled:
+            self.scheduled = True
+            loop.call_soon(self.flush)
+        return future
+
+    def flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        self.scheduled = False
+        for name, requests in pending.items():
+            try:
+                actions = self.greedy_actions(name, [state for state, _ in requests])
+            except Exception:
+                # a bad state fails the whole lookup, answer one by one so only its table gets the error
+                for state, future in requests:
+                    try:
+                        action = self.greedy_actions(name, [state])[0]
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(action)
+            else:
+                for (_, future), action in zip(requests, actions):
+                    if not future.done():
+                        future.set_result(action)
+            self.batches += 1
+            self.requests += len(requests)
+
+    def greedy_actions(self, name, states) -> list:
+        states = np.fromiter(states, dtype=np.int64, count=len(states))
+        # ties go to the lowest action, as in Evaluation.greedy_actions
+        return self.q_tables[name][states].argmax(axis=1).tolist()
+
+
+class ServerStats:
+    """
+    Attributes:
+        tables_opened, tables_finished, turns: counts since the server started
+        tables_dropped: tables that ended early, on an error or a closed connection
+        decision_latency: seconds from a turn message to the remote seat's play, for the last max_samples decisions
+        step_per_turn: seconds a finished table spent stepping its game per turn, waits excluded
+    """
+
+    def __init__(self, max_samples=100_000):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.tables_opened = 0
+        self.tables_finished = 0
+        self.tables_dropped = 0
+        self.turns = 0
+        self.decision_latency = deque(maxlen=max_samples)
+        self.step_per_turn = deque(maxlen=max_samples)
+
+    def finish_table(self, step_seconds, turns) -> None:
+        self.tables_finished += 1
+        self.turns += turns
+        self.step_per_turn.append(step_seconds / max(turns, 1))
+
+    def report(self, batcher=None) -> dict:
+        """
+        tables_per_core is the number of tables finished per second of CPU time used by this process, the rate one
+        busy core would sustain
+        """
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        report = {'tables_open': self.tables_opened - self.tables_finished - self.tables_dropped,
+                  'tables_finished': self.tables_finished,
+                  'tables_dropped': self.tables_dropped,
+                  'turns': self.turns,
+                  'tables_per_second': self.tables_finished / wall if wall else 0.,
+                  'tables_per_core': self.tables_finished / cpu if cpu else 0.,
+                  'cpu_utilization': cpu / wall if wall else 0.,
+                  'decision_latency_ms': {k: 1e3 * v for k, v in percentiles(self.decision_latency).items()},
+                  'step_per_turn_us': {k: 1e6 * v for k, v in percentiles(self.step_per_turn).items()}}
+        if batcher is not None:
+            report['policy_batch_size'] = batcher.requests / batcher.batches if batcher.batches else 0.
+        return report
+
+
+class Table:
+    """
+    One game, played by its task in Table.play
+    Attributes:
+        id: table number, unique in the server
+        game: the Spinner
+        policies: dict from seat to the name of the Q-policy playing it
+        remote_seats: seats played by the connection
+        choice: future of the remote play being waited for, None between remote turns
+    """
+
+    def __init__(self, server, table_id, connection, seats, seed=None, params=None):
+        if not seats or len(seats) > 8:
+            raise Exception(f'A table needs 1 to 8 seats, got {seats}')
+        params = dict(server.params, **{k: v for k, v in (params or {}).items() if k in TABLE_PARAMS})
+        strategies = []
+        self.policies = {}
+        for seat, kind in enumerate(seats):
+            if kind == 'remote':
+                strategies.append('human')
+            elif kind.startswith('policy:'):
+                name = kind.split(':', 1)[1]
+                if name not in server.batcher.q_tables:
+                    raise Exception(f'Unknown policy {name}')
+                self.policies[seat] = name
+                strategies.append('agent')
+            elif kind in BOT_STRATEGIES:
+                strategies.append(kind)
+            else:
+                raise Exception(f'Unknown seat {kind}, seats are remote, policy:<name> or one of {BOT_STRATEGIES}')
+        players = [{'id': seat, 'strategy': strategy, 'verbose': False} for seat, strategy in enumerate(strategies)]
+        self.game = Spinner(dict(params, players=players, seed=seed))
+        if self.policies and self.game.action_space_type not in ACTION_KEYS:
+            raise Exception(f'Policy seats need an action space in {list(ACTION_KEYS)}')
+        for name in set(self.policies.values()):
+            shape = server.batcher.q_tables[name].shape
+            if shape != (self.game.get_num_states(), self.game.get_num_actions()):
+                raise Exception(f'Policy {name} has shape {shape}, this table has '
+                                f'{self.game.get_num_states()} states and {self.game.get_num_actions()} actions')
+        self.id = table_id
+        self.server = server
+        self.connection = connection
+        self.remote_seats = [seat for seat, strategy in enumerate(strategies) if strategy == 'human']
+        self.choice = None
+        self.num_plays = 0
+
+    async def play(self):
+        """
+        Plays the game to its end, awaiting remote and policy seats
+        :return: score totals, seconds spent stepping the game, and number of turns
+        """
+        game = self.game
+        action_keys = ACTION_KEYS.get(game.action_space_type)
+        step_seconds, turns = 0., 0
+        start = time.perf_counter()
+        game.new_game()
+        while not game.game_done:
+            player = game.current_player
+            action = None
+            if player.strategy in ('human', 'agent'):
+                plays = player.get_valid_plays()
+                if len(plays) >= 2:
+                    step_seconds += time.perf_counter() - start
+                    if player.strategy == 'human':
+                        action = await self.ask(player, plays)
+                    else:
+                        action = action_keys[await self.server.batcher.action(self.policies[player.id],
+                                                                              game.get_state())]
+                    start = time.perf_counter()
+            round_number = game.round
+            player.play_turn(action)
+            game.end_turn()
+            turns += 1
+            if game.round != round_number:
+                # tables with bot seats only never wait, so they let the other tables run between rounds
+                step_seconds += time.perf_counter() - start
+                await asyncio.sleep(0)
+                start = time.perf_counter()
+        step_seconds += time.perf_counter() - start
+        return game.calc_score_totals(), step_seconds, turns
+
+    async def ask(self, player, plays):
+        """:return: index in plays of the play chosen by the connection"""
+        game = self.game
+        hand = player.hand
+        self.choice = asyncio.get_running_loop().create_future()
+        self.num_plays = len(plays)
+        sent = time.perf_counter()
+        await self.connection.send({'type': 'turn', 'table': self.id, 'seat': player.id, 'round': game.round,
+                                    'board': [str(t) for t in game.board.tiles],
+                                    'ends': list(game.board.get_usable_exposed_ends()),
+                                    'hand': [str(t) for t in hand],
+                                    'plays': [[str(hand[i]), end] for i, end in plays]})
+        try:
+            choice = await asyncio.wait_for(self.choice, self.server.turn_timeout)
+        finally:
+            self.choice = None
+        self.server.stats.decision_latency.append(time.perf_counter() - sent)
+        return choice
+
+    def receive(self, choice) -> None:
+        if self.choice is None:
+            raise Exception(f'Table {self.id} is not waiting for a play')
+        if not isinstance(choice, int) or choice not in range(self.num_plays):
+            raise Exception(f'Table {self.id} choice must be an index below {self.num_plays}, got {choice}')
+        self.choice.set_result(choice)
+
+
+class Connection:
+    """
+    One client, and the tables it opened
+    Attributes:
+        tables: dict from table id to Table
+        tasks: dict from table id to the task playing it
+    """
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.tables = {}
+        self.tasks = {}
+
+    async def send(self, message) -> None:
+        self.writer.write((json.dumps(message) + '\n').encode())
+        await self.writer.drain()
+
+    async def serve(self) -> None:
+        try:
+            while line := await self.reader.readline():
+                try:
+                    self.handle(json.loads(line))
+                except Exception as e:
+                    await self.send({'type': 'error', 'message': str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            for task in list(self.tasks.values()):
+                task.cancel()
+            self.writer.close()
+
+    def handle(self, message) -> None:
+        if not isinstance(message, dict):
+            raise Exception('Messages must be JSON objects')
+        match message.get('type'):
+            case 'new_table':
+                table = self.server.new_table(self, message.get('seats'), message.get('seed'), message.get('params'))
+                self.tables[table.id] = table
+                self.tasks[table.id] = asyncio.create_task(self.run_table(table))
+            case 'play':
+                table = self.tables.get(message.get('table'))
+                if table is None:
+                    raise Exception(f'No table {message.get("table")} on this connection')
+                table.receive(message.get('choice'))
+            case other:
+                raise Exception(f'Unknown message type {other}')
+
+    async def run_table(self, table) -> None:
+        try:
+            await self.send({'type': 'joined', 'table': table.id, 'seats': table.remote_seats})
+            totals, step_seconds, turns = await table.play()
+            self.server.stats.finish_table(step_seconds, turns)
+            await self.send({'type': 'game_over', 'table': table.id, 'scores': totals.tolist(),
+                             'winners': np.flatnonzero(totals == totals.min()).tolist()})
+        except asyncio.CancelledError:
+            self.server.stats.tables_dropped += 1
+            raise
+        except Exception as e:
+            self.server.stats.tables_dropped += 1
+            if not self.writer.is_closing():
+                await self.send({'type': 'error', 'table': table.id, 'message': f'{type(e).__name__}: {e}'})
+        finally:
+            table.game.close()
+            del self.tables[table.id]
+            del self.tasks[table.id]
+
+
+class GameServer:
+    """
+    Attributes:
+        params: Spinner params of every table, before the client's TABLE_PARAMS
+        batcher: PolicyBatcher holding the Q-policies
+        stats: ServerStats
+        turn_timeout: seconds a remote seat has to play, None to wait forever
+    """
+
+    def __init__(self, params=None, q_tables=None, turn_timeout=None):
+        self.params = dict(BASE_PARAMS, **(params or {}))
+        self.batcher = PolicyBatcher(q_tables or {})
+        self.stats = ServerStats()
+        self.turn_timeout = turn_timeout
+        self.next_table_id = 0
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8765):
+        """Starts listening, port 0 picks a free port.  :return: the asyncio Server"""
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit=1 << 20)
+        return self.server
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle_connection(self, reader, writer) -> None:
+        await Connection(self, reader, writer).serve()
+
+    def new_table(self, connection, seats, seed=None, params=None) -> Table:
+        table = Table(self, self.next_table_id, connection, seats, seed, params)
+        self.next_table_id += 1
+        self.stats.tables_opened += 1
+        return table
+
+    def report(self) -> dict:
+        return self.stats.report(self.batcher)
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def load_connection(host, port, seeds, seats, rng, latencies):
+    """
+    Plays one table per seed over a single connection, all at once, answering each turn with a random valid play.
+    latencies gets the seconds from each play sent to the next message of its table.
+    :return: number of tables finished
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    sent = {}
+    finished = 0
+    for seed in seeds:
+        writer.write((json.dumps({'type': 'new_table', 'seats': seats, 'seed': seed}) + '\n').encode())
+    await writer.drain()
+    while finished < len(seeds):
+        line = await reader.readline()
+        if not line:
+            raise Exception('Server closed the connection')
+        message = json.loads(line)
+        table = message.get('table')
+        if table in sent:
+            latencies.append(time.perf_counter() - sent.pop(table))
+        match message['type']:
+            case 'turn':
+                choice = int(rng.integers(len(message['plays'])))
+                writer.write((json.dumps({'type': 'play', 'table': table, 'choice': choice}) + '\n').encode())
+                sent[table] = time.perf_counter()
+            case 'game_over':
+                finished += 1
+            case 'error':
+                raise Exception(f'Server error: {message["message"]}')
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+    return finished
+
+
+async def run_load(host, port, num_tables=1000, num_connections=10, seats=('remote', 'random'), seed=0):
+    """
+    Opens num_tables tables over num_connections connections, all playing at once
+    :return: dict with the tables finished, wall seconds, tables per second and response latency percentiles in ms
+    """
+    rng = np.random.default_rng(seed)
+    latencies = []
+    start = time.perf_counter()
+    chunks = np.array_split(np.arange(seed, seed + num_tables), num_connections)
+    finished = await asyncio.gather(*(load_connection(host, port, chunk.tolist(), list(seats), rng, latencies)
+                                      for chunk in chunks if chunk.size))
+    seconds = time.perf_counter() - start
+    return {'tables': sum(finished),
+            'seconds': seconds,
+            'tables_per_second': sum(finished) / seconds,
+            'response_ms': {k: 1e3 * v for k, v in percentiles(latencies).items()}}
+
+
+def load_policies(specs):
+    """:param specs: list of name=path.npy strings.  :return: dict from name to q_table"""
+    q_tables = {}
+    for spec in specs or []:
+        name, _, path = spec.partition('=')
+        if not path:
+            raise Exception(f'Policies are given as name=path.npy, got {spec}')
+        q_tables[name] = np.load(path)
+    return q_tables
+
+
+def print_report(title, report):
+    print(title)
+    for key, value in report.items():
+        if isinstance(value, dict):
+            value = '  '.join(f'{k} {v:.3f}' for k, v in value.items())
+        elif isinstance(value, float):
+            value = f'{value:.3f}'
+        print(f'  {key}: {value}')
+
+
+async def serve(args):
+    server = GameServer(q_tables=load_policies(args.policy), turn_timeout=args.turn_timeout)
+    await server.start(args.host, args.port)
+    print(f'Serving on {args.host}:{server.port}')
+    while True:
+        await asyncio.sleep(args.report_every)
+        print_report('Server', server.report())
+
+
+async def bench(args):
+    server = GameServer(q_tables=load_policies(args.policy), turn_timeout=args.turn_timeout)
+    await server.start(args.host, 0)
+    load = await run_load(args.host, server.port, args.tables, args.connections, args.seats, args.seed)
+    print_report('Load generator', load)
+    print_report('Server', server.report())
+    await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='asyncio Spinner game server and load generator')
+    parser.add_argument('mode', choices=['serve', 'load', 'bench'], help='bench runs the server and the load '
+                                                                         'generator in this process')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--policy', action='append', help='Q-policy seat as name=path.npy, may be repeated')
+    parser.add_argument('--turn-timeout', type=float, help='seconds a remote seat has to play')
+    parser.add_argument('--report-every', type=float, default=10., help='seconds between server reports')
+    parser.add_argument('--tables', type=int, default=1000, help='tables opened by the load generator')
+    parser.add_argument('--connections', type=int, default=10)
+    parser.add_argument('--seats', nargs='+', default=['remote', 'random'], help='seats of each load table')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    match args.mode:
+        case 'serve':
+            asyncio.run(serve(args))
+        case 'load':
+            print_report('Load generator', asyncio.run(run_load(args.host, args.port, args.tables, args.connections,
+                                                                args.seats, args.seed)))
+        case 'bench':
+            asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""This script contains the opt-in instrumentation used to profile the Spinner game."""
+import time
+
+
+class Instrumentation:
+    """
+    Per-phase call counters and cumulative timers for a Spinner game.  Spinner.instrumentation is None unless
+    params['instrument'] is set or enable_instrumentation() is called, and every hook checks for None before
+    calling the timer, so a game without instrumentation pays one attribute check per hook.
+    Attributes:
+        counts: dict from phase to number of timed calls
+        seconds: dict from phase to total time spent in the phase
+    Phases:
+        deal: Spinner.deal
+        draw: draws in Player.play_turn when a player has no valid play
+        valid_plays: Player.get_valid_plays searches that missed the cache
+        place_tile: Board.receive_tile
+        round_scoring: Spinner.update_round_scores
+        agent_decision: QAgent action choice
+    """
+    PHASES = ('deal', 'draw', 'valid_plays', 'place_tile', 'round_scoring', 'agent_decision')
+
+    # Alias so the hooks don't look up the time module
+    timer = staticmethod(time.perf_counter)
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.PHASES, 0)
+        self.seconds = dict.fromkeys(self.PHASES, 0.)
+
+    def record(self, phase, elapsed):
+        self.counts[phase] += 1
+        self.seconds[phase] += elapsed
+
+    def reset(self):
+        self.counts = dict.fromkeys(self.PHASES, 0)
+        self.seconds = dict.fromkeys(self.PHASES, 0.)
+
+    def snapshot(self) -> dict:
+        """
+        :return: dict from phase to a dict with count, seconds and mean_us (mean microseconds per call)
+        """
+        return {phase: {'count': self.counts[phase],
+                        'seconds': self.seconds[phase],
+                        'mean_us': 1e6 * self.seconds[phase] / self.counts[phase] if self.counts[phase] else 0.}
+                for phase in self.counts}
+
+    def __str__(self):
+        lines = [f'{"phase":16s}{"count":>12s}{"seconds":>12s}{"mean us":>12s}']
+        for phase, s in self.snapshot().items():
+            lines.append(f'{phase:16s}{s["count"]:12d}{s["seconds"]:12.3f}{s["mean_us"]:12.2f}')
+        return '\n'.join(lines)
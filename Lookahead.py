@@ -0,0 +1,252 @@
+"""
+This script contains the determinized Monte Carlo lookahead used by the 'lookahead' Player strategy.
+
+The searching player only knows its own hand, the board, and how many tiles each other hand and the boneyard hold.
+For each sample, the tiles it cannot see are shuffled and dealt back to the other hands and the boneyard in those
+numbers (a determinization).  Then each valid play is tried and the round is played out with a heuristic rollout
+strategy for every seat.  The play with the lowest mean round score for the searching player is chosen.  Every valid
+play is rolled out on the same determinizations, so the plays are compared on the same hidden tiles.
+
+Results are kept in a bounded LRU transposition table keyed on the Zobrist hash of the position as the player sees
+it, so a position seen again in the game starts from the rollouts already done.  The table is cleared when a new
+game starts, so a game does not depend on the games played before it.  With num_workers > 1 the samples are split over
+a process pool in which each worker has its own rollout game.
+
+    params['players'] = [{'id': 0, 'strategy': 'lookahead', 'verbose': False,
+                          'lookahead': {'rollouts': 200, 'time_limit': 0.5}},
+                         {'id': 1, 'strategy': 'random', 'verbose': False}]
+"""
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+# Rollout game of this worker process, see init_worker
+worker_game = None
+
+
+class InformationSet(NamedTuple):
+    """
+    What the player to move knows of the position.  Tiles are given by Tile.id, so an InformationSet means the same
+    position in every process.
+    """
+    seat: int
+    round: int
+    board_tiles: tuple
+    exposed_ends: tuple
+    exposed_double: object
+    exposed_double_count: int
+    hand: tuple
+    hand_sizes: tuple  # number of tiles in the hand of each seat
+    boneyard_size: int
+
+
+class TableEntry:
+    """
+    Rollout results of one information set in the transposition table
+    Attributes:
+        plays: valid plays as (Tile.id, end value), in the order of get_valid_plays
+        score_totals: sum of the searching player's round score over the rollouts of each play
+        samples: number of determinizations rolled out, each play has one rollout per sample
+    """
+
+    def __init__(self, plays):
+        self.plays = plays
+        self.score_totals = np.zeros(len(plays))
+        self.samples = 0
+
+    def mean_scores(self):
+        return self.score_totals / max(self.samples, 1)
+
+
+def make_rollout_game(game_class, params, rollout_strategy):
+    players = [{'id': seat, 'strategy': rollout_strategy, 'verbose': False} for seat in range(len(params['players']))]
+    return game_class(dict(params, players=players, verbose=False, zobrist=False, instrument=False, seed=None))
+
+
+def init_worker(game_class, params, rollout_strategy):
+    global worker_game
+    worker_game = make_rollout_game(game_class, params, rollout_strategy)
+
+
+def worker_rollouts(info, plays, num_samples, seed):
+    return rollouts(worker_game, info, plays, num_samples, seed)
+
+
+def rollouts(game, info, plays, num_samples, seed):
+    """
+    Rolls every play out on num_samples determinizations of info
+    :param game: rollout game, its players all play the rollout strategy
+    :param plays: plays to try, as in TableEntry
+    :param seed: seed for the game's random generator, used for the determinizations and the rollouts
+    :return: sum over the samples of the searching player's round score after each play
+    """
+    game.seed(seed)
+    tiles = game.tile_master
+    seen = set(info.board_tiles) | set(info.hand)
+    unseen = np.array([i for i in range(len(tiles)) if i not in seen], dtype=np.int64)
+    totals = np.zeros(len(plays))
+    for _ in range(num_samples):
+        deal = game.rng.permutation(unseen).tolist()
+        for p, play in enumerate(plays):
+            set_position(game, info, deal)
+            totals[p] += play_out(game, info.seat, tiles[play[0]], play[1])
+    return totals
+
+
+def set_position(game, info, deal):
+    """Loads info into game, with the tiles in deal dealt to the other hands and the boneyard in that order."""
+    tiles = game.tile_master
+    board = game.board
+    board.tiles = [tiles[i] for i in info.board_tiles]
+    board.exposed_ends = list(info.exposed_ends)
+    board.exposed_double = info.exposed_double
+    board.exposed_double_count = info.exposed_double_count
+    board.version += 1
+    start = 0
+    for seat, player in enumerate(game.players):
+        if seat == info.seat:
+            player.hand = [tiles[i] for i in info.hand]
+        else:
+            player.hand = [tiles[i] for i in deal[start:start + info.hand_sizes[seat]]]
+            start += info.hand_sizes[seat]
+        player.sort_hand()
+        player.invalidate_valid_plays()
+    game.boneyard = [tiles[i] for i in deal[start:]]
+    game.round = info.round
+    game.current_player = game.players[info.seat]
+    game.round_done = False
+    game.game_done = False
+
+
+def play_out(game, seat, tile, end_value):
+    """
+    Plays tile on end_value for seat, then plays the round to its end as Spinner.play_round does
+    :return: round score of seat
+    """
+    player = game.players[seat]
+    player.place_tile_from_hand((player.hand.index(tile), end_value))
+    game.update_game_and_round_done()
+    game.next_player()
+    while not game.round_done:
+        game.current_player.play_turn()
+        game.update_game_and_round_done()
+        game.next_player()
+    return player.get_score()
+
+
+class Lookahead:
+    """
+    Determinized Monte Carlo search for one player.  A move stops searching after `rollouts` samples in total for
+    the position, counting those already in the table, or after time_limit seconds, whichever comes first.
+    Attributes:
+        rollouts: samples per move, None for no limit
+        time_limit: seconds per move, None for no limit
+        rollout_strategy: strategy every seat plays in the rollouts, 'random', 'play_high' or 'play_low'
+        batch_size: samples per job, the budget is checked between batches
+        num_workers: processes the samples are spread over, 1 to roll out in this process
+        max_entries: size of the transposition table, the least recently used position is dropped first
+        table: OrderedDict from position key to TableEntry
+        hits, misses: number of moves that found or did not find their position in the table
+    """
+
+    def __init__(self, rollouts=100, time_limit=None, rollout_strategy='play_high', batch_size=25, num_workers=1,
+                 max_entries=100_000):
+        if rollouts is None and time_limit is None:
+            raise Exception('Lookahead needs a rollouts or time_limit budget')
+        self.rollouts = rollouts
+        self.time_limit = time_limit
+        self.rollout_strategy = rollout_strategy
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.max_entries = max_entries
+        self.table = OrderedDict()
+        self.reset_stats()
+        self.game = None  # rollout game when num_workers is 1, the pool workers have their own
+        self.pool = None
+
+    def choose_play(self, player, valid_plays):
+        """
+        :param player: player to move, must be the current player of its game
+        :param valid_plays: player.get_valid_plays()
+        :return: the valid play with the lowest mean round score in the rollouts
+        """
+        game = player.game
+        hashing = game.zobrist is not None
+        if not hashing:
+            game.enable_hashing()
+        try:
+            return self.choose_hashed_play(game, player, valid_plays)
+        finally:
+            if not hashing:
+                game.disable_hashing()
+
+    def choose_hashed_play(self, game, player, valid_plays):
+        """choose_play, once game keeps the Zobrist hash"""
+        hand = player.hand
+        plays = tuple((hand[i].id, end) for i, end in valid_plays)
+        info = self.information_set(game, player)
+        key = (game.zobrist.information_set_value(game, player), info.hand_sizes, info.boneyard_size)
+
+        entry = self.table.get(key)
+        if entry is None or entry.plays != plays:
+            self.misses += 1
+            entry = TableEntry(plays)
+            self.table[key] = entry
+            if len(self.table) > self.max_entries:
+                self.table.popitem(last=False)
+        else:
+            self.hits += 1
+            self.table.move_to_end(key)
+        self.search(game, info, entry)
+        scores = entry.mean_scores()
+        best = np.flatnonzero(scores == scores.min())
+        return valid_plays[int(game.choice(best))]
+
+    def information_set(self, game, player) -> InformationSet:
+        board = game.board
+        return InformationSet(player.id, game.round, tuple(t.id for t in board.tiles),
+                              tuple(board.exposed_ends), board.exposed_double, board.exposed_double_count,
+                              tuple(t.id for t in player.hand), tuple(len(p.hand) for p in game.players),
+                              len(game.boneyard))
+
+    def search(self, game, info, entry) -> None:
+        """Adds rollouts to entry until the budget of the move is spent"""
+        if len(entry.plays) < 2:
+            return
+        start = time.perf_counter()
+        while self.rollouts is None or entry.samples < self.rollouts:
+            if self.time_limit is not None and time.perf_counter() - start >= self.time_limit:
+                break
+            wanted = self.batch_size * self.num_workers
+            if self.rollouts is not None:
+                wanted = min(wanted, self.rollouts - entry.samples)
+            sizes = [n for n in np.diff(np.linspace(0, wanted, self.num_workers + 1).astype(int)) if n > 0]
+            # seeds come from the game's generator, so a seeded game searches the same way every time
+            seeds = [int(s) for s in game.rng.integers(2 ** 63, size=len(sizes))]
+            entry.score_totals += sum(self.run_jobs(game, info, entry.plays, sizes, seeds))
+            entry.samples += wanted
+
+    def run_jobs(self, game, info, plays, sizes, seeds):
+        if self.num_workers == 1:
+            if self.game is None:
+                self.game = make_rollout_game(type(game), game.params, self.rollout_strategy)
+            return [rollouts(self.game, info, plays, n, seed) for n, seed in zip(sizes, seeds)]
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.num_workers, initializer=init_worker,
+                                            initargs=(type(game), game.params, self.rollout_strategy))
+        return list(self.pool.map(worker_rollouts, [info] * len(sizes), [plays] * len(sizes), sizes, seeds))
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = 0
+
+    def clear(self) -> None:
+        self.table.clear()
+
+    def close(self) -> None:
+        """Shuts the worker pool down, a later move starts a new one"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -1,7 +1,9 @@
 """This script contains the classes used in the Spinner game."""
-import random
 from typing import Union
 
+from Endgame import EndgameSolver
+from Lookahead import Lookahead
+
 
 class Player:
     """
@@ -9,30 +11,57 @@ class Player:
     Attributes:
         game (Game): the game
         strategy (str): the strategy deployed by the player.  Can be 'random', 'play_high', 'play_low',
-                        'human' or 'agent'
+                        'lookahead', 'endgame', 'human' or 'agent'
         hand (Hand): the hand of the player, list of Tile objects
         verbose: flag for output
-        id:  the player id
+        id:  the player's seat, its index in game.players
         max_turns: limit on maximum turns for a player for debugging.  Set to None for no limit.
+        valid_plays_hits, valid_plays_misses: number of get_valid_plays calls served from the cache or recomputed
+        lookahead: Lookahead search of the 'lookahead' strategy, None for the other strategies
+        endgame_solver: EndgameSolver of the 'endgame' strategy, which plays perfectly once the boneyard is empty and
+                        plays high before, None for the other strategies
     """
-    id = 0
-
-    def __init__(self, game, strategy, verbose=False, max_turns=None):
+    def __init__(self, game, strategy, verbose=False, max_turns=None, lookahead=None, endgame=None, seat=0):
+        """
+        :param seat: index of the player in game.players
+        :param lookahead: dict of Lookahead params for the 'lookahead' strategy, None for the defaults
+        :param endgame: dict of EndgameSolver params for the 'endgame' strategy, None for the defaults
+        """
         self.game = game
         self.strategy = strategy
         self.hand = []
         self.verbose = verbose
-        self.id = Player.id
+        self.id = seat
         self.max_turns = max_turns
-        Player.id += 1
+        self.valid_plays = None
+        self.valid_plays_board_version = None
+        self.valid_plays_hits = 0
+        self.valid_plays_misses = 0
+        self.lookahead = Lookahead(**(lookahead or {})) if strategy == 'lookahead' else None
+        self.endgame_solver = EndgameSolver(**(endgame or {})) if strategy == 'endgame' else None
 
     def reset_hand(self):
         self.hand = []
+        self.invalidate_valid_plays()
+
+    def clear_search_tables(self):
+        """
+        Drops the positions the search strategies keep from earlier moves.  Spinner.new_game calls it, so a game is
+        played the same way whatever games the player played before, in this process or another.
+        """
+        if self.lookahead is not None:
+            self.lookahead.clear()
+        if self.endgame_solver is not None:
+            self.endgame_solver.clear()
+
+    def invalidate_valid_plays(self):
+        """Drops the cached valid plays, must be called whenever the hand changes."""
+        self.valid_plays = None
 
     def play_turn(self, agent_action=None):
         """
         Method to play a turn.  Plays autonomously for all strategies except agent
-        For agent, must be passed with action.  For other strategies action argument is ignored.
+        For agent, must be passed with action.  For human, may be passed the index of the chosen valid play.
         Args:
             agent_action: action to be taken by agent.
 
@@ -60,13 +89,21 @@ class Player:
         match len(valid_plays):
             case 0:
                 play = 'Draw'
-                self.draw_tile_to_hand()
+                stats = self.game.instrumentation
+                if stats is not None:
+                    start = stats.timer()
+                    self.draw_tile_to_hand()
+                    stats.record('draw', stats.timer() - start)
+                else:
+                    self.draw_tile_to_hand()
             case 1:
                 play = valid_plays[0]
                 self.place_tile_from_hand(play)
             case _:
                 play = self.choose_valid_play(valid_plays, agent_action)
                 self.place_tile_from_hand(play)
+                if self.game.recorder is not None:
+                    self.game.recorder.record_choice(valid_plays, play)
 
         if self.verbose:
             print(f'Strategy {self.strategy} play: {play} \n'
@@ -78,7 +115,9 @@ class Player:
         :param valid_plays:  A list of available actions for the players turn.  Actions are passed as tuples of
                                 (index, end) where index is the index of the tile in the players hand
                                 and end is the exposed end of the board on which the tile is to be played.
-        :param agent_action: The action to be taken in the event the Player is an agent strategy type
+        :param agent_action: The action to be taken in the event the Player is an agent strategy type.  For human,
+                                the index of the chosen play in valid_plays when the choice was made elsewhere, such
+                                as by a GameServer client, None to ask on the console.
         :return: action tuple as specified above
         """
 
@@ -88,6 +127,10 @@ class Player:
                 raise Exception('Cannot choose_valid_play() for agent without with action = None')
             else:
                 value_to_match = agent_action
+        elif self.strategy == 'human' and agent_action is not None:
+            if agent_action not in range(len(valid_plays)):
+                raise Exception(f'Cannot choose_valid_play() {agent_action} of {len(valid_plays)} valid plays')
+            return valid_plays[agent_action]
         else:
             if agent_action is not None:
                 raise Exception(f'Cannot choose_valid_play() for strategy {self.strategy} '
@@ -95,7 +138,7 @@ class Player:
 
         match value_to_match:
             case 'random':
-                return random.choice(valid_plays)
+                return self.game.choice(valid_plays)
 
             case 'play_high':
                 return self.choose_high_low_tile(valid_plays, high=True)
@@ -103,6 +146,16 @@ class Player:
             case 'play_low':
                 return self.choose_high_low_tile(valid_plays, high=False)
 
+            case 'lookahead':
+                return self.lookahead.choose_play(self, valid_plays)
+
+            case 'endgame':
+                if len(self.game.boneyard) == 0:
+                    play, _ = self.endgame_solver.solve(self.game)
+                    if play is not None:
+                        return play
+                return self.choose_high_low_tile(valid_plays, high=True)
+
             case 'human':
                 output = ' '.join([f'{i}-{self.hand[a[0]]}-[{a[1]}]  ' for i, a in enumerate(valid_plays)])
                 print(f'Available actions: {output}')
@@ -115,6 +168,27 @@ class Player:
                 raise ValueError(f'choose_valid_play() - Undefined player strategy {self.strategy}')
 
     def get_valid_plays(self) -> list[tuple[int, Union[int, str]]]:
+        """
+        Method to get the valid plays for the players hand.  The result is cached until the hand or the board changes,
+        so callers must not modify the returned list.
+        :return: List of actions, see find_valid_plays
+        """
+        board_version = self.game.board.version
+        if self.valid_plays is not None and self.valid_plays_board_version == board_version:
+            self.valid_plays_hits += 1
+            return self.valid_plays
+        self.valid_plays_misses += 1
+        stats = self.game.instrumentation
+        if stats is not None:
+            start = stats.timer()
+            self.valid_plays = self.find_valid_plays()
+            stats.record('valid_plays', stats.timer() - start)
+        else:
+            self.valid_plays = self.find_valid_plays()
+        self.valid_plays_board_version = board_version
+        return self.valid_plays
+
+    def find_valid_plays(self) -> list[tuple[int, Union[int, str]]]:
         """
         Method to search players hand for playable tiles given the playable exposed ends of the board
         :return: List of actions that are possible given a player's hand and the board's exposed tiles
@@ -144,15 +218,20 @@ class Player:
         """
         This method removes a tile from the boneyard, puts it in the players hand and sort the
         players hand by tile index.  If the boneyard is empty, prints a message to the console
-        :return: None
+        :return: the tile drawn, None if the boneyard was empty
         """
         new_tile = self.game.draw_tile()
         if new_tile:
             self.hand.append(new_tile)
             self.sort_hand()
+            self.invalidate_valid_plays()
+            if self.game.zobrist is not None:
+                self.game.zobrist.toggle_boneyard_tile(new_tile)
+                self.game.zobrist.toggle_hand_tile(self, new_tile)
         else:
             pass
             # print('Boneyard empty!!!!!!!!!!')
+        return new_tile
 
     def place_tile_from_hand(self, action):
         """
@@ -160,20 +239,24 @@ class Player:
         using  the receive_tile method for the board.
         :param action: tuple specify the index of the tile to play form the players hand and the exposed end
         oof the board on which the tile should be placed.
-        :return: None
+        :return: the tile placed
         """
         if len(self.hand) == 0:
             raise Exception(f'Player hand is empty, cannot place_tile_from_hand')
         tile_to_play = self.hand.pop(action[0])
+        self.invalidate_valid_plays()
+        if self.game.zobrist is not None:
+            self.game.zobrist.toggle_hand_tile(self, tile_to_play)
         value_of_end_to_play = action[1]
         self.game.board.receive_tile(tile_to_play, value_of_end_to_play)
+        return tile_to_play
 
     def choose_high_low_tile(self, action_list, high):
         action_list_tile_values = [self.hand[i].value for i, _ in action_list]
         max_min_value = max(action_list_tile_values) if high else min(action_list_tile_values)
         indices = [i for i, v in enumerate(action_list_tile_values) if v == max_min_value]
         actions_chosen = [action_list[i] for i in indices]
-        return random.choice(actions_chosen)
+        return self.game.choice(actions_chosen)
 
     def need_agent_input(self):
         return self.strategy == 'agent' and len(self.get_valid_plays()) >= 2
@@ -185,6 +268,18 @@ class Player:
     def sort_hand(self):
         self.hand.sort(key=lambda t: t.id)
 
+    def snapshot_hand(self):
+        return tuple(self.hand)
+
+    def restore_hand(self, hand):
+        self.hand = list(hand)
+        self.invalidate_valid_plays()
+
+    def close(self):
+        """Releases the worker processes of the 'lookahead' strategy, if any"""
+        if self.lookahead is not None:
+            self.lookahead.close()
+
     def hand_to_string(self):
         return ' '.join(map(str, self.hand)) if self.hand else 'Empty'
 
@@ -5,9 +5,12 @@ Author: Harris Rose
 This code creates a Q-Learning agent for the Spinner environment.
 """
 
-import random
+import os
+
 import numpy as np
 
+from StateIndex import GrowableTable, StateIndex
+
 
 class QAgent:
 
@@ -16,7 +19,10 @@ class QAgent:
                  epsilon=0.2,
                  gamma=0.9,
                  eps_to_zero_at = None,
-                 verbose =True):
+                 verbose =True,
+                 prune_every=None,
+                 prune_min_visits=2,
+                 state_index=None):
         self.env = env
         self.alpha = alpha
         self.epsilon = epsilon
@@ -25,8 +31,19 @@ class QAgent:
         self.eps_to_zero_at = eps_to_zero_at
         self.num_actions = self.env.get_num_actions()
         self.num_states = self.env.get_num_states()
-        self.q_table = np.zeros((self.num_states, self.num_actions))
-        self.n_table = np.zeros((self.num_states, self.num_actions))
+        self.state_index = None
+        if self.num_states is None:
+            # env numbers states as it sees them with the agent's StateIndex, the tables grow with it
+            self.state_index = state_index if state_index is not None else StateIndex()
+            self.env.state_index = self.state_index
+            self.q_table = GrowableTable(self.num_actions)
+            self.n_table = GrowableTable(self.num_actions)
+        else:
+            self.q_table = np.zeros((self.num_states, self.num_actions))
+            self.n_table = np.zeros((self.num_states, self.num_actions))
+        self.prune_every = prune_every  # episodes between calls to prune_states, None to never prune
+        self.prune_min_visits = prune_min_visits
+        self.instrumentation = None  # snapshot of env.instrumentation taken at the end of learn()
 
     def generate_episode(self, q_update=True):
         # implement Q-Learning algorithm
@@ -36,8 +53,14 @@ class QAgent:
         if self.verbose:
             print(f'Generating New Episode Current State, reward, term: {current_state} {reward} {terminal}')
 
+        stats = self.env.instrumentation
         while not terminal:
-            action = self.choose_action_e_greedy(current_state)
+            if stats is not None:
+                start = stats.timer()
+                action = self.choose_action_e_greedy(current_state)
+                stats.record('agent_decision', stats.timer() - start)
+            else:
+                action = self.choose_action_e_greedy(current_state)
             new_state, reward, terminal = self.env.execute_action(action)
             if self.verbose:
                 print(f'Executing action: {action} New State, reward, terminal: {new_state} {reward} {terminal}')
@@ -61,21 +84,142 @@ class QAgent:
             wins[i] = 1 if win else 0
             if i == self.eps_to_zero_at:
                  self.epsilon = 0.
+            if self.prune_every is not None and (i + 1) % self.prune_every == 0:
+                self.prune_states(self.prune_min_visits)
 
+        if self.env.instrumentation is not None:
+            self.instrumentation = self.env.instrumentation.snapshot()
+            if self.verbose:
+                print(self.env.instrumentation)
         return wins
 
+    def prune_states(self, min_visits):
+        """
+        Drops the states seen fewer than min_visits times from the agent's StateIndex and from the tables.
+        Only for envs with a state encoder, and only between episodes, since the kept states are renumbered.
+        """
+        keep = self.state_index.prune(min_visits)
+        self.q_table.compact(keep)
+        self.n_table.compact(keep)
+
+    @staticmethod
+    def state_index_path(path):
+        """:return: path of the StateIndex saved next to the q_table saved to path"""
+        return os.path.splitext(path)[0] + '.states.json'
+
+    def save(self, path):
+        """
+        Saves q_table to path (.npy).  With a state encoder, the rows of the states seen so far are saved, and the
+        StateIndex that numbers them is saved next to it, see state_index_path.
+        """
+        if self.state_index is None:
+            np.save(path, self.q_table)
+            return
+        np.save(path, np.asarray(self.q_table)[:len(self.state_index)])
+        self.state_index.save(self.state_index_path(path))
+
+    def load(self, path):
+        """Loads a q_table saved by save(), and its StateIndex, which is handed to the env.  n_table starts over."""
+        q_table = np.load(path)
+        if self.state_index is None:
+            self.q_table = q_table
+            self.n_table = np.zeros_like(q_table)
+            return
+        self.state_index = StateIndex.load(self.state_index_path(path))
+        self.env.state_index = self.state_index
+        self.q_table = GrowableTable(self.num_actions, capacity=max(64, len(q_table)))
+        self.q_table.data[:len(q_table)] = q_table
+        self.n_table = GrowableTable(self.num_actions, capacity=len(self.q_table))
+
     def exploit(self, episodes=1000):
+        """
+        Plays the greedy policy without learning.  Evaluation.evaluate does the same over many seeded games.
+        :return: array of wins, 1 for the episodes won
+        """
+        wins = np.empty(episodes)
+        epsilon, self.epsilon = self.epsilon, 0.
         for i in range(episodes):
-            wins = np.empty(episodes)
-            reward, win = self.generate_episode(q_update=False)
+            win = self.generate_episode(q_update=False)
             wins[i] = 1 if win else 0
-            return wins
+        self.epsilon = epsilon
+        return wins
 
     def choose_action_e_greedy(self, state):
-        if random.random() < self.epsilon:
-            return np.random.randint(self.num_actions)
+        # random numbers come from the env's generator, so seeding the env reproduces training
+        if self.env.rng.random() < self.epsilon:
+            return self.env.choice(range(self.num_actions))
         else:
-            q_values = self.q_table[state]
+            q_values = self.q_table[state].copy()  # copied, AsyncQLearning workers update the table concurrently
             max_q = np.max(q_values)
             actions = np.where(q_values == max_q)[0]
-            return np.random.choice(actions)
+            return self.env.choice(actions)
+
+
+class BatchQAgent:
+    """
+    Trains num_agents independent Q-Learning agents at once on a VecSpinner with one game per agent.  Agent k has
+    q_table[k] and plays env game k, all agents are updated together with fancy indexing.  Episodes in which the agent
+    never has to choose an action are skipped by VecSpinner and not counted.
+    """
+
+    def __init__(self, env,
+                 alpha=0.1,
+                 epsilon=0.2,
+                 gamma=0.9,
+                 eps_to_zero_at=None,
+                 seed=None,
+                 verbose=True):
+        self.env = env
+        self.num_agents = env.num_envs
+        self.alpha = alpha
+        self.epsilon = np.full(self.num_agents, epsilon)
+        self.gamma = gamma
+        self.verbose = verbose
+        self.eps_to_zero_at = eps_to_zero_at
+        self.rng = np.random.default_rng(seed)
+        self.num_actions = self.env.get_num_actions()
+        self.num_states = self.env.get_num_states()
+        self.q_table = np.zeros((self.num_agents, self.num_states, self.num_actions))
+        self.n_table = np.zeros((self.num_agents, self.num_states, self.num_actions))
+
+    def learn(self, episodes=1000):
+        """
+        Trains every agent for the given number of episodes
+        :return: (num_agents, episodes) array, 1 for the episodes each agent won
+        """
+        wins = np.zeros((self.num_agents, episodes))
+        episode = np.zeros(self.num_agents, dtype=np.int64)
+        agents = np.arange(self.num_agents)
+        states, _, _ = self.env.reset()
+
+        while np.any(episode < episodes):
+            actions = self.choose_actions_e_greedy(states)
+            new_states, rewards, dones = self.env.step(actions)
+            # finished games are reset by the env, bootstrap from the state the game ended in as QAgent does
+            next_states = np.where(dones, self.env.final_states, new_states)
+
+            k = agents[episode < episodes]
+            s, a = states[k], actions[k]
+            target = rewards[k] + self.gamma * self.q_table[k, next_states[k]].max(axis=1)
+            self.q_table[k, s, a] += self.alpha * (target - self.q_table[k, s, a])
+            self.n_table[k, s, a] = 1
+
+            k = k[dones[k]]
+            wins[k, episode[k]] = rewards[k] == 100
+            self.epsilon[k[episode[k] == self.eps_to_zero_at]] = 0.
+            episode[k] += 1
+            if self.verbose and k.size:
+                print(f'Episodes finished per agent: min {episode.min()} max {episode.max()}')
+            states = new_states
+
+        return wins
+
+    def choose_actions_e_greedy(self, states):
+        q_values = self.q_table[np.arange(self.num_agents), states]
+        # random tie-breaking, the greedy action is the best-valued action with the largest random key
+        keys = np.where(q_values == q_values.max(axis=1, keepdims=True),
+                        self.rng.random(q_values.shape), -1.)
+        actions = keys.argmax(axis=1)
+        explore = self.rng.random(self.num_agents) < self.epsilon
+        actions[explore] = self.rng.integers(self.num_actions, size=int(explore.sum()))
+        return actions
@@ -0,0 +1,184 @@
+"""
+This script contains batched Q-Learning self-play, where several 'agent' seats of the same Spinner games learn at once.
+
+num_games games are played side by side.  Each game always has exactly one agent seat waiting for a decision, so a
+step answers one decision per game: the states of all the games are looked up in the q_tables of the policies of
+their seats with a single fancy index, and the actions are chosen e-greedily for the whole batch.  Seats sharing a
+policy learn one q_table, so
+
+    seat_policies=[0, 0]     trains one policy against itself
+    seat_policies=[0, 1, 1]  trains policy 0 against two seats of policy 1 in the same games (a small league)
+
+Seats that are not 'agent' in params play their own strategy and have no policy.  A seat's transition is updated
+when it is next asked to act, with no reward, or when its game ends, with its reward from Spinner.get_rewards and a
+bootstrap from the state the game ended in, as QAgent does.  The updates of a step are applied together with
+np.add.at, so seats that update the same entry of a shared q_table in one step all count.
+
+    python SelfPlay.py --games 256 --episodes 20000 --save self_play.npy
+"""
+import argparse
+
+import numpy as np
+
+from Spinner import ACTION_KEYS, Spinner
+
+DEFAULT_PARAMS = {'max_pips': 9,
+                  'spinners': False,
+                  'allow_chickenfeet': False,
+                  'initial_hand_size': 7,
+                  'end_round': 0,
+                  'state_type': 'two_exposed_ends',
+                  'action_space_type': 'hl',
+                  'players': [{'id': 0, 'strategy': 'agent', 'verbose': False},
+                              {'id': 1, 'strategy': 'agent', 'verbose': False}],
+                  'verbose': False}
+
+
+class SelfPlay:
+    """
+    Attributes:
+        games: the Spinner games, game i is seeded with seed + i
+        seat_policies: (num_players,) policy of each seat, -1 for seats that are not 'agent'
+        q_table: (num_policies, num_states, num_actions) action values
+        n_table: (num_policies, num_states, num_actions) visited flags, 1 once a policy has taken the action in the
+                 state and 0 before, as in QAgent.  It is not a visit count.
+        seats, states: seat to act and its state in each game
+        last_states, last_actions: (num_games, num_players) last decision of each seat in its current game, action -1
+                                   before the seat's first decision
+        skipped_episodes: games that ended without an agent decision, replayed and not counted
+    """
+
+    def __init__(self, params, num_games, seat_policies=None, alpha=0.1, epsilon=0.2, gamma=0.9, seed=None,
+                 verbose=True):
+        strategies = [p['strategy'] for p in params['players']]
+        if 'agent' not in strategies:
+            raise Exception(f'SelfPlay needs at least one agent seat, strategies are {strategies}')
+        if params['action_space_type'] not in ACTION_KEYS:
+            raise Exception(f'Invalid action space type {params["action_space_type"]}')
+        if seat_policies is None:
+            seat_policies = [0 if s == 'agent' else -1 for s in strategies]
+        self.seat_policies = np.array(seat_policies, dtype=np.int64)
+        if len(self.seat_policies) != len(strategies) or \
+                any((p >= 0) != (s == 'agent') for p, s in zip(self.seat_policies, strategies)):
+            raise Exception(f'seat_policies must give a policy to exactly the agent seats, got {seat_policies} '
+                            f'for strategies {strategies}')
+
+        self.params = params
+        self.num_games = num_games
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.gamma = gamma
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+        self.games = [Spinner(dict(params, seed=None if seed is None else seed + i)) for i in range(num_games)]
+        self.num_players = len(strategies)
+        self.num_policies = int(self.seat_policies.max()) + 1
+        self.num_actions = self.games[0].get_num_actions()
+        self.num_states = self.games[0].get_num_states()
+        if self.num_states is None:
+            raise Exception(f'SelfPlay needs a state type with a fixed number of states, got {params["state_type"]}')
+        self.q_table = np.zeros((self.num_policies, self.num_states, self.num_actions))
+        self.n_table = np.zeros((self.num_policies, self.num_states, self.num_actions))
+
+        self.seats = np.zeros(num_games, dtype=np.int64)
+        self.states = np.zeros(num_games, dtype=np.int64)
+        self.last_states = np.zeros((num_games, self.num_players), dtype=np.int64)
+        self.last_actions = np.full((num_games, self.num_players), -1, dtype=np.int64)
+        self.skipped_episodes = 0
+
+    def reset_game(self, g) -> None:
+        seat, state, _, done = self.games[g].reset_seats()
+        while done:
+            self.skipped_episodes += 1
+            seat, state, _, done = self.games[g].reset_seats()
+        self.seats[g] = seat
+        self.states[g] = state
+        self.last_actions[g] = -1
+
+    def learn(self, episodes=1000):
+        """
+        Plays until the given number of games have finished, counted over all the games
+        :return: (episodes,) seat that won each episode, in the order they finished
+        """
+        winners = np.zeros(episodes, dtype=np.int64)
+        finished = 0
+        for g in range(self.num_games):
+            self.reset_game(g)
+        games = np.arange(self.num_games)
+
+        while finished < episodes:
+            finished_before = finished
+            policies = self.seat_policies[self.seats]
+            actions = self.choose_actions_e_greedy(policies, self.states)
+
+            # the previous decision of each acting seat leads to the state it acts in now
+            had = self.last_actions[games, self.seats] >= 0
+            updates = [(policies[had], self.last_states[games, self.seats][had],
+                        self.last_actions[games, self.seats][had], np.zeros(int(had.sum())), self.states[had])]
+            self.last_states[games, self.seats] = self.states
+            self.last_actions[games, self.seats] = actions
+            np.maximum.at(self.n_table, (policies, self.states, actions), 1)
+
+            for g, game in enumerate(self.games):
+                seat, state, rewards, done = game.execute_seat_action(int(actions[g]))
+                if not done:
+                    self.seats[g] = seat
+                    self.states[g] = state
+                    continue
+                # every agent seat that acted in the game learns its reward
+                acted = np.flatnonzero(self.last_actions[g] >= 0)
+                updates.append((self.seat_policies[acted], self.last_states[g, acted], self.last_actions[g, acted],
+                                rewards[acted], np.full(acted.size, state)))
+                if finished < episodes:
+                    winners[finished] = game.find_game_winner_index()
+                    finished += 1
+                self.reset_game(g)
+
+            self.update(*(np.concatenate(column) for column in zip(*updates)))
+            if self.verbose and finished // 1000 > finished_before // 1000:
+                print(f'Episodes finished: {finished}')
+
+        return winners
+
+    def update(self, policies, states, actions, rewards, next_states) -> None:
+        """Q-Learning update of a batch of transitions, targets are computed before any of them is applied"""
+        if policies.size == 0:
+            return
+        q = self.q_table
+        target = rewards + self.gamma * q[policies, next_states].max(axis=1)
+        np.add.at(q, (policies, states, actions), self.alpha * (target - q[policies, states, actions]))
+
+    def choose_actions_e_greedy(self, policies, states):
+        q_values = self.q_table[policies, states]
+        # random tie-breaking, as in BatchQAgent
+        keys = np.where(q_values == q_values.max(axis=1, keepdims=True), self.rng.random(q_values.shape), -1.)
+        actions = keys.argmax(axis=1)
+        explore = self.rng.random(len(states)) < self.epsilon
+        actions[explore] = self.rng.integers(self.num_actions, size=int(explore.sum()))
+        return actions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Q-Learning self-play with every agent seat learning at once')
+    parser.add_argument('--games', type=int, default=256, help='games played side by side')
+    parser.add_argument('--episodes', type=int, default=20000)
+    parser.add_argument('--seat-policies', type=int, nargs='+', help='policy of each seat, default one shared '
+                                                                     'policy for every seat')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='path of the .npy file the q_tables are saved to')
+    args = parser.parse_args()
+
+    params = DEFAULT_PARAMS
+    if args.seat_policies is not None:
+        params = dict(DEFAULT_PARAMS, players=[{'id': seat, 'strategy': 'agent', 'verbose': False}
+                                               for seat in range(len(args.seat_policies))])
+    trainer = SelfPlay(params, args.games, args.seat_policies, seed=args.seed, verbose=False)
+    winners = trainer.learn(args.episodes)
+    wins = np.bincount(winners, minlength=trainer.num_players)
+    print(f'{args.episodes} episodes, wins by seat: {wins.tolist()}, skipped: {trainer.skipped_episodes}')
+    if args.save:
+        np.save(args.save, trainer.q_table)
+
+
+if __name__ == '__main__':
+    main()
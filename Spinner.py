@@ -1,11 +1,48 @@
 """This script contains the classes used in the Spinner game."""
-import random
+from typing import NamedTuple
+
 import numpy as np
 
 from Board import Board
+from Instrumentation import Instrumentation
 from Player import Player
+from StateEncoder import STATE_ENCODERS
+from StateIndex import StateIndex
 from Tile import Tile
 from TileSet import TileSet
+from Zobrist import Zobrist
+
+# Maps agent actions to the strategy played for each action space type
+ACTION_KEYS = {'hrl': {0: 'play_low', 1: 'random', 2: 'play_high'},
+               'hl': {0: 'play_low', 1: 'play_high'},
+               'h': {0: 'play_high'},
+               'r': {0: 'random'}}
+
+# Version of everything a game record leaves to the engine: the deals drawn from deal_seed, the order of
+# Player.get_valid_plays and the starting player choices.  Bump it when any of them changes, GameRecord.replay_game
+# then rejects the records made before.
+REPLAY_VERSION = 1
+
+
+class SpinnerSnapshot(NamedTuple):
+    """
+    Immutable record of a Spinner game returned by Spinner.snapshot().  Tiles are shared with the game, they are never
+    modified.  hands and boneyard are tuples of Tile.  scores_by_round is a read-only copy.
+    """
+    board_tiles: tuple
+    exposed_ends: tuple
+    exposed_double: object
+    exposed_double_count: int
+    hands: tuple
+    boneyard: object
+    round: int
+    scores_by_round: np.ndarray
+    current_player: int
+    round_done: bool
+    game_done: bool
+    rng_state: dict  # None if the snapshot was taken without the state of the game's random generator
+    position_hash: int = None  # Zobrist hash, None if hashing was off
+    deal_rng_state: dict = None  # state of the deal generator, None when rng_state is None
 
 
 class Spinner(object):
@@ -19,40 +56,53 @@ class Spinner(object):
         self.spinners = params['spinners']
         self.allow_chickenfeet = params['allow_chickenfeet']
         self.verbose = params['verbose']
+        self.instrumentation = Instrumentation() if params.get('instrument', False) else None
+        # Every random choice in the game, its players and its QAgent comes from this generator, see seed()
+        self.rng = np.random.default_rng(params.get('seed'))
+        # Deals and starting players come from a generator of their own, seeded from rng by new_game, so they do not
+        # depend on the plays and a game replays from deal_seed and its decisions, see GameRecord.py
+        self.deal_seed = None
+        self.deal_rng = None
+        self.recorder = None  # GameRecordWriter that logs the games, see GameRecord.py
+        self.zobrist = None  # Zobrist hash of the position, kept up to date by Board and Player, see enable_hashing()
 
         self.state_type = params['state_type']
         self.action_space_type = params['action_space_type']
+        # Other state types are StateEncoders whose feature tuples are numbered by a StateIndex as they are seen.  The
+        # index belongs to the q_table its ids number, a QAgent replaces this one with its own
+        self.state_encoder = None
+        self.state_index = None
+        if self.state_type not in ['two_exposed_ends', 'one_state']:
+            if self.state_type not in STATE_ENCODERS:
+                raise Exception(f'Invalid state type, {self.state_type} not defined.')
+            self.state_encoder = STATE_ENCODERS[self.state_type]()
+            self.state_index = StateIndex()
 
         self.starting_round = self.max_pips
         self.ending_round = params['end_round']
         self.init_hand_size = params['initial_hand_size']
 
         # Create master set of tiles, Board, and Players
-        self.tile_master = TileSet(self.max_pips, self.spinners).tiles
+        self.tile_master = TileSet.shared(self.max_pips, self.spinners).tiles
         self.board = Board(self, self.allow_chickenfeet)
-        self.players = [Player(self, p['strategy'], p['verbose']) for p in params['players']]
+        self.players = [Player(self, p['strategy'], p['verbose'], lookahead=p.get('lookahead'),
+                               endgame=p.get('endgame'), seat=seat)
+                        for seat, p in enumerate(params['players'])]
 
         # Create parameters for specific game that can be reset for new game
         self.round = self.starting_round
         self.scores_by_round = np.zeros((self.starting_round + 1, self.num_players))
 
-        self.current_player = random.choice(self.players)
+        self.current_player = self.players[0]  # until new_game picks the first player
         self.round_done = False
         self.game_done = False
 
-        self.boneyard = self.tile_master.copy()
-        self.deal()
+        self.new_game()
+        if params.get('zobrist', False):
+            self.enable_hashing(debug=params['zobrist'] == 'debug')
 
     def reset(self):
-        if self.verbose: print('Resetting....')
-        self.round = self.starting_round
-        self.scores_by_round = np.zeros((self.starting_round + 1, self.num_players))
-        self.board.reset_for_new_round()
-        for p in self.players:
-            p.reset_hand()
-        self.boneyard = self.tile_master.copy()
-        self.deal()
-        self.current_player = random.choice(self.players)
+        self.new_game()
         self.play_until_need_agent_action()
         state = self.get_state()
         reward = self.get_reward()
@@ -62,27 +112,58 @@ class Spinner(object):
             print('-'*60)
         return state, reward, self.game_done
 
+    def new_game(self, deal_seed=None) -> None:
+        """
+        Method to deal the first round of a new game and pick its first player, without playing any turn.  Callers
+        that drive the turns themselves, such as GameServer, start games with it, reset() plays on to the agent.
+        :param deal_seed: seed of the deals and starting players of the game, None to draw it from the game's generator
+        :return: None
+        """
+        if self.verbose: print('Resetting....')
+        self.deal_seed = int(self.rng.integers(2 ** 63)) if deal_seed is None else deal_seed
+        self.deal_rng = np.random.default_rng(self.deal_seed)
+        self.round = self.starting_round
+        self.scores_by_round = np.zeros((self.starting_round + 1, self.num_players))
+        self.board.reset_for_new_round()
+        for p in self.players:
+            p.reset_hand()
+            p.clear_search_tables()
+        self.deal()
+        first_player = self.choice(self.players, self.deal_rng)
+        if self.zobrist is not None:
+            self.zobrist.change_player(self.current_player, first_player)
+        self.current_player = first_player
+
+    def reset_seats(self):
+        """
+        Method to start a new game with any number of agent seats, see execute_seat_action
+        :return: seat to act, None if the game ended without an agent decision, state, rewards of every seat, done
+        """
+        self.new_game()
+        seat = self.play_until_need_agent_action()
+        return seat, self.get_state(), self.get_rewards(), self.game_done
+
+    def execute_seat_action(self, agent_action):
+        """
+        Method to play the action of the agent seat to move and the turns after it, until an agent seat has to act
+        again.  Unlike execute_action, the seat that acts next and the rewards of every seat are returned, so several
+        learners can share a game.
+        :param agent_action: action of the current player, which must be an agent seat
+        :return: seat to act, None once the game is done, state, rewards of every seat, done
+        """
+        state, _, done = self.execute_action(agent_action)
+        return (None if done else self.current_player.id), state, self.get_rewards(), done
+
     def execute_action(self, agent_action):
         if self.current_player.strategy != 'agent':
             raise Exception('Cannot execute action unless current player is agent')
 
         if self.verbose:
             print(f'Executing action: {agent_action}')
-        if self.action_space_type == 'hrl':
-            action_key = {0: 'play_low', 1: 'random', 2: 'play_high'}
-            agent_action = action_key[agent_action]
-        elif self.action_space_type == 'hl':
-            action_key = {0: 'play_low', 1: 'play_high'}
-            agent_action = action_key[agent_action]
-        elif self.action_space_type == 'h':
-            action_key = {0: 'play_high'}
-            agent_action = action_key[agent_action]
-        elif self.action_space_type == 'r':
-            action_key = {0: 'random'}
-            agent_action = action_key[agent_action]
+        if self.action_space_type in ACTION_KEYS:
+            agent_action = ACTION_KEYS[self.action_space_type][agent_action]
         self.current_player.play_turn(agent_action)
-        self.update_game_and_round_done()
-        self.next_player()
+        self.end_turn()
         self.play_until_need_agent_action()
         state = self.get_state()
         reward = self.get_reward()
@@ -93,14 +174,26 @@ class Spinner(object):
         return state, reward, self.game_done
 
     def play_until_need_agent_action(self):
+        """:return: seat of the agent that has to act, None once the game is done"""
         while not self.game_done and not self.current_player.need_agent_input():
             self.current_player.play_turn()
-            self.update_game_and_round_done()
-            self.next_player()
-            if self.round_done and not self.game_done:
-                self.update_round_scores()
-                self.setup_new_round()
+            self.end_turn()
+        return None if self.game_done else self.current_player.id
 
+    def end_turn(self):
+        """
+        Method to finish a turn in agent mode.  Updates done flags, passes play to the next player and, if the round
+        is over, scores it and sets up the next round.  The final round is scored too so get_reward sees it.
+        :return: None
+        """
+        self.update_game_and_round_done()
+        self.next_player()
+        if self.round_done:
+            self.update_round_scores()
+            if not self.game_done:
+                self.setup_new_round()
+            elif self.recorder is not None:
+                self.recorder.record_game_end(self)
 
     def get_state(self, state_type='two_exposed_ends'):
         match self.state_type:
@@ -118,14 +211,23 @@ class Spinner(object):
                                         f'exposed_ends = {exp_ends}')
             case 'one_state':
                 return 0
+            case _ if self.state_encoder is not None:
+                return self.state_index.id(self.state_encoder.features(self))
             case _:
                 raise Exception(f'Invalid state type, {self.state_type} not defined.')
 
-    def get_reward(self):
-        if self.game_done and self.find_game_winner_index() == 0:
+    def get_reward(self, seat=0):
+        if self.game_done and self.find_game_winner_index() == seat:
             return 100
         return 0
 
+    def get_rewards(self):
+        """:return: (num_players,) reward of every seat, 100 for the winner once the game is done"""
+        rewards = np.zeros(self.num_players, dtype=np.int64)
+        if self.game_done:
+            rewards[self.find_game_winner_index()] = 100
+        return rewards
+
     def get_num_actions(self):
         match self.action_space_type:
             case 'hrl':
@@ -145,6 +247,8 @@ class Spinner(object):
                 return 111
             case 'one_state':
                 return 1
+            case _ if self.state_encoder is not None:
+                return None  # not known in advance, see state_index
             case _:
                 raise Exception('Invalid state type')
 
@@ -177,6 +281,8 @@ class Spinner(object):
             self.play_round()
             if not self.game_done:
                 self.setup_new_round()
+        if self.recorder is not None:
+            self.recorder.record_game_end(self)
         print('Game done!')
         print('Game scores by round')
         print(self.scores_by_round)
@@ -188,11 +294,10 @@ class Spinner(object):
         # Figure out starting player
         prior_round_scores = self.scores_by_round[self.round, :].tolist()
         prior_round_winner_indices = [i for i, v in enumerate(prior_round_scores) if v == min(prior_round_scores)]
-        self.current_player = self.players[random.choice(prior_round_winner_indices)]
+        self.current_player = self.players[self.choice(prior_round_winner_indices, self.deal_rng)]
 
         # Set round parameters
         self.round -= 1
-        self.boneyard = self.tile_master.copy()
         self.board.reset_for_new_round()
         for p in self.players:
             p.reset_hand()
@@ -221,31 +326,165 @@ class Spinner(object):
                   f'{self.scores_by_round[self.round]}\n')
 
     def update_round_scores(self):
+        stats = self.instrumentation
+        if stats is not None:
+            start = stats.timer()
         round_scores = [p.get_score() for p in self.players]
         self.scores_by_round[self.round] = round_scores
+        if stats is not None:
+            stats.record('round_scoring', stats.timer() - start)
 
     def next_player(self) -> None:
-        current_player_index = self.current_player.id
-        next_player_index = (current_player_index + 1) % self.num_players
-        self.current_player = self.players[next_player_index]
+        previous_player = self.current_player
+        self.current_player = self.players[(previous_player.id + 1) % self.num_players]
+        zobrist = self.zobrist
+        if zobrist is not None:
+            zobrist.change_player(previous_player, self.current_player)
+            if zobrist.debug:
+                zobrist.check(self)
+
+    def seed(self, seed=None) -> None:
+        """
+        Method to restart the game's random generator.  Games reset after the same seed play out the same in any
+        process, given the same agent actions.
+        :param seed: seed for numpy.random.default_rng, None for fresh entropy
+        :return: None
+        """
+        self.rng = np.random.default_rng(seed)
+
+    def choice(self, items, rng=None):
+        # Uniform choice from a sequence, cheaper than Generator.choice or Generator.integers for a single item
+        return items[int((self.rng if rng is None else rng).random() * len(items))]
+
+    def shuffle_boneyard(self) -> None:
+        # The boneyard is shuffled once and drawn from the end, so each draw is O(1)
+        boneyard = self.boneyard
+        self.boneyard = [boneyard[i] for i in self.rng.permutation(len(boneyard))]
 
     def draw_tile(self) -> (Tile, None):
         # Take a tile form boneyard and return it.  If boneyard empty, return None
         if self.boneyard:
             if self.verbose:
                 print(f'Drawing tile from boneyard. {len(self.boneyard) - 1} tiles left.')
-            return self.boneyard.pop(random.randint(0, len(self.boneyard) - 1))
+            return self.boneyard.pop()
         else:
             if self.verbose:
                 print("Boneyard was empty when draw_tile was called.")
             return None
 
     def deal(self):
+        stats = self.instrumentation
+        if stats is not None:
+            start = stats.timer()
         if self.verbose: print(f'Dealing....')
+        tiles = self.tile_master
+        self.boneyard = [tiles[i] for i in self.deal_rng.permutation(len(tiles))]
         for player in self.players:
             player.hand = [self.draw_tile() for _ in range(self.init_hand_size)]
             player.sort_hand()
+            player.invalidate_valid_plays()
         self.update_game_and_round_done()
+        if self.zobrist is not None:
+            self.zobrist.reset(self)
+        if self.recorder is not None:
+            self.recorder.record_deal(self)
+        if stats is not None:
+            stats.record('deal', stats.timer() - start)
+
+    def enable_instrumentation(self) -> Instrumentation:
+        """Starts recording per-phase counts and timings, returns the Instrumentation holding them."""
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation()
+        return self.instrumentation
+
+    def disable_instrumentation(self) -> None:
+        self.instrumentation = None
+
+    def enable_hashing(self, debug=False) -> Zobrist:
+        """
+        Starts keeping the Zobrist hash of the position, read it with position_hash()
+        :param debug: check the incremental hash against a full recompute after every turn
+        :return: Zobrist holding the hash
+        """
+        if self.zobrist is None:
+            self.zobrist = Zobrist(self, debug)
+        self.zobrist.debug = debug
+        return self.zobrist
+
+    def disable_hashing(self) -> None:
+        self.zobrist = None
+
+    def position_hash(self) -> int:
+        # 64 bit hash of the position, equal positions have equal hashes in every process
+        if self.zobrist is None:
+            raise Exception('Spinner.position_hash called without enable_hashing')
+        return self.zobrist.value
+
+    def snapshot(self, include_rng=True) -> SpinnerSnapshot:
+        """
+        Method to record the full game state, e.g. before a lookahead rollout.  Only the mutable containers are
+        copied, so this is far cheaper than copy.deepcopy.
+        :param include_rng: record the state of the game's random generators.  Rollouts that want fresh randomness
+                            can leave it out.  The order of the boneyard is always recorded, call
+                            shuffle_boneyard() after restore() for fresh draws.
+        :return: SpinnerSnapshot to pass to restore()
+        """
+        board = self.board
+        scores = self.scores_by_round.copy()
+        scores.flags.writeable = False
+        return SpinnerSnapshot(tuple(board.tiles), tuple(board.exposed_ends), board.exposed_double,
+                               board.exposed_double_count, tuple(p.snapshot_hand() for p in self.players),
+                               self.snapshot_boneyard(), self.round, scores, self.current_player.id,
+                               self.round_done, self.game_done,
+                               self.rng.bit_generator.state if include_rng else None,
+                               None if self.zobrist is None else self.zobrist.value,
+                               self.deal_rng.bit_generator.state if include_rng else None)
+
+    def restore(self, snapshot: SpinnerSnapshot) -> None:
+        """
+        Method to load a state recorded by snapshot() back into this game
+        :param snapshot: SpinnerSnapshot from this game or one with the same params
+        :return: None
+        """
+        board = self.board
+        board.tiles = list(snapshot.board_tiles)
+        board.exposed_ends = list(snapshot.exposed_ends)
+        board.exposed_double = snapshot.exposed_double
+        board.exposed_double_count = snapshot.exposed_double_count
+        board.version += 1
+        for player, hand in zip(self.players, snapshot.hands):
+            player.restore_hand(hand)
+        self.restore_boneyard(snapshot.boneyard)
+        self.round = snapshot.round
+        self.scores_by_round = snapshot.scores_by_round.copy()
+        self.current_player = self.players[snapshot.current_player]
+        self.round_done = snapshot.round_done
+        self.game_done = snapshot.game_done
+        if snapshot.rng_state is not None:
+            self.rng.bit_generator.state = snapshot.rng_state
+        if snapshot.deal_rng_state is not None:
+            self.deal_rng.bit_generator.state = snapshot.deal_rng_state
+        if self.zobrist is not None:
+            if snapshot.position_hash is None:
+                self.zobrist.reset(self)
+            else:
+                self.zobrist.value = snapshot.position_hash
+
+    def snapshot_boneyard(self):
+        return tuple(self.boneyard)
+
+    def restore_boneyard(self, boneyard):
+        self.boneyard = list(boneyard)
+
+    def get_valid_plays_cache_stats(self):
+        hits = sum(p.valid_plays_hits for p in self.players)
+        misses = sum(p.valid_plays_misses for p in self.players)
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / max(hits + misses, 1)}
+
+    def close(self) -> None:
+        """Releases what the players hold beyond the game, such as Lookahead worker pools"""
+        for p in self.players:
+            p.close()
 
     def boneyard_to_str(self):
         return ' '.join(map(str, self.boneyard))
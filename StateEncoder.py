@@ -0,0 +1,73 @@
+"""
+This script contains the state encoders that Spinner can use in place of its built-in state types.
+
+An encoder turns the game, as seen by the agent, into a hashable tuple of features.  Spinner passes the tuple to a
+StateIndex, which gives each distinct tuple a dense id the first time it is seen, so an encoder does not need to know
+how many states it can produce.  Encoders are chosen with params['state_type'] and new ones are added with
+register_state_encoder.
+"""
+
+
+class StateEncoder:
+    """
+    Base class of the state encoders.  Subclasses set name and implement features.
+    """
+    name = None
+
+    def features(self, game) -> tuple:
+        raise NotImplementedError
+
+    @staticmethod
+    def agent(game):
+        return next(p for p in game.players if p.strategy == 'agent')
+
+
+class ExposedEndsEncoder(StateEncoder):
+    """Usable exposed ends, sorted.  Same information as 'two_exposed_ends' without the limit of two ends."""
+    name = 'exposed_ends'
+
+    def features(self, game):
+        return tuple(sorted(game.board.get_usable_exposed_ends()))
+
+
+class HandEncoder(StateEncoder):
+    """Usable exposed ends, and for each of them the number of tiles in the agent's hand that match it."""
+    name = 'hand'
+
+    def features(self, game):
+        ends = sorted(game.board.get_usable_exposed_ends())
+        hand = self.agent(game).hand
+        return (tuple(ends),
+                tuple(sum(1 for t in hand if e in (t.low, t.high) or t.high == 'S') for e in ends))
+
+
+class RichEncoder(StateEncoder):
+    """
+    Usable exposed ends, exposed double, matching tiles in the agent's hand, agent hand size, boneyard size and
+    hand size of every opponent.  Sizes above size_cap are cut to size_cap to keep the number of states down.
+    """
+    name = 'rich'
+    size_cap = 10
+
+    def features(self, game):
+        agent = self.agent(game)
+        ends = sorted(game.board.get_usable_exposed_ends())
+        hand = agent.hand
+        cap = self.size_cap
+        return (tuple(ends),
+                game.board.exposed_double or 0,
+                tuple(sum(1 for t in hand if e in (t.low, t.high) or t.high == 'S') for e in ends),
+                min(len(hand), cap),
+                min(len(game.boneyard), cap),
+                tuple(min(len(p.hand), cap) for p in game.players if p is not agent))
+
+
+STATE_ENCODERS = {cls.name: cls for cls in [ExposedEndsEncoder, HandEncoder, RichEncoder]}
+
+
+def register_state_encoder(cls):
+    """Makes an encoder class available as params['state_type'] = cls.name.  Can be used as a class decorator."""
+    if cls.name in ['two_exposed_ends', 'one_state']:
+        raise Exception(f'State type {cls.name} is built into Spinner')
+    STATE_ENCODERS[cls.name] = cls
+    return cls
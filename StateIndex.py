@@ -0,0 +1,143 @@
+"""
+This script contains the sparse state index and the growable tables used with the state encoders in StateEncoder.py.
+
+StateIndex gives every feature tuple a dense id the first time it is seen and counts how often each id is looked up.
+GrowableTable is a (states, actions) array that grows as ids are handed out, so QAgent can keep its q_table and
+n_table for a state space whose size is not known in advance.  States seen fewer than min_visits times can be pruned
+from the index and the tables together, which renumbers the states that are kept.
+
+An index belongs to the q_table whose rows its ids number, so QAgent owns it, hands it to its env and saves it next to
+the q_table.
+"""
+import json
+import sys
+
+import numpy as np
+
+
+class StateIndex:
+    """
+    Attributes:
+        ids: dict from feature tuple to state id
+        keys: feature tuple of each state id
+        visits: number of lookups of each state id, only the first len(keys) entries are used
+    """
+
+    def __init__(self, capacity=64):
+        self.ids = {}
+        self.keys = []
+        self.visits = np.zeros(capacity, dtype=np.int64)
+
+    def id(self, features):
+        i = self.ids.get(features)
+        if i is None:
+            i = len(self.keys)
+            self.ids[features] = i
+            self.keys.append(features)
+            if i == len(self.visits):
+                self.visits = np.concatenate([self.visits, np.zeros(len(self.visits), dtype=np.int64)])
+        self.visits[i] += 1
+        return i
+
+    def __len__(self):
+        return len(self.keys)
+
+    def prune(self, min_visits):
+        """
+        Drops the states looked up fewer than min_visits times and renumbers the rest in their old order.
+        :return: bool mask over the old state ids, True for the states kept.  Pass it to GrowableTable.compact.
+        """
+        keep = self.visits[:len(self.keys)] >= min_visits
+        self.keys = [k for k, kept in zip(self.keys, keep) if kept]
+        self.ids = {k: i for i, k in enumerate(self.keys)}
+        visits = self.visits[:len(keep)][keep]
+        self.visits = np.zeros(max(64, 2 * len(visits)), dtype=np.int64)
+        self.visits[:len(visits)] = visits
+        return keep
+
+    def save(self, path):
+        """Writes the feature tuples, in id order, and their visit counts to path as JSON."""
+        with open(path, 'w') as f:
+            json.dump({'keys': self.keys, 'visits': self.visits[:len(self.keys)].tolist()}, f)
+
+    @classmethod
+    def load(cls, path):
+        """:return: the StateIndex saved to path by save(), with the same ids"""
+        with open(path) as f:
+            saved = json.load(f)
+        index = cls(max(64, 2 * len(saved['keys'])))
+        index.keys = [as_tuple(k) for k in saved['keys']]
+        index.ids = {k: i for i, k in enumerate(index.keys)}
+        index.visits[:len(index.keys)] = saved['visits']
+        return index
+
+    def memory_bytes(self):
+        """Approximate memory held by the index: the dict, the key list, the feature tuples and the visit counts."""
+        size = sys.getsizeof(self.ids) + sys.getsizeof(self.keys) + self.visits.nbytes
+        seen = set()
+        stack = list(self.keys)
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            size += sys.getsizeof(obj)
+            if isinstance(obj, tuple):
+                stack.extend(obj)
+        return size
+
+
+def as_tuple(value):
+    """Turns the nested lists JSON makes of a feature tuple back into tuples."""
+    return tuple(as_tuple(v) for v in value) if isinstance(value, list) else value
+
+
+class GrowableTable:
+    """
+    (states, num_actions) array indexed like a NumPy array by state id, or by (state id, action).  Indexing a state past
+    the end doubles the capacity, new rows are zero.
+    Attributes:
+        data: the underlying array, only rows of state ids already handed out are meaningful
+    """
+
+    def __init__(self, num_actions, capacity=64, dtype=np.float64):
+        self.data = np.zeros((capacity, num_actions), dtype=dtype)
+
+    def _fit(self, key):
+        state = key[0] if isinstance(key, tuple) else key
+        if state >= len(self.data):
+            grown = np.zeros((max(2 * len(self.data), state + 1), self.data.shape[1]), dtype=self.data.dtype)
+            grown[:len(self.data)] = self.data
+            self.data = grown
+
+    def __getitem__(self, key):
+        self._fit(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self._fit(key)
+        self.data[key] = value
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def compact(self, keep):
+        """Keeps the rows of the states kept by StateIndex.prune, renumbered to match the index."""
+        kept = self.data[:len(keep)][keep]
+        self.data = np.zeros((max(64, 2 * len(kept)), self.data.shape[1]), dtype=self.data.dtype)
+        self.data[:len(kept)] = kept
+
+
+def memory_report(state_index, *tables):
+    """:return: dict with the number of states and the bytes used by the index and the tables"""
+    report = {'states': len(state_index), 'index_bytes': state_index.memory_bytes(),
+              'table_bytes': sum(t.nbytes for t in tables)}
+    report['total_bytes'] = report['index_bytes'] + report['table_bytes']
+    return report
@@ -0,0 +1,219 @@
+"""
+This script contains a vectorized Spinner environment that runs its games in worker processes.
+
+num_envs Spinner games are split over num_workers processes.  Actions, states, rewards, done flags and the final
+states of finished games live in arrays in shared memory, so a step only sends a one byte command to each worker and
+waits for a one byte reply.  Games are reset automatically when they finish, as in VecSpinner.
+
+    env = SubprocVecSpinner(params, num_envs=64, num_workers=4, seed=0)
+    states, rewards, dones = env.reset()
+    env.step_async(actions)
+    ...  # other work while the workers play
+    states, rewards, dones = env.step_wait()
+    env.close()
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from Spinner import Spinner
+
+RESET, STEP, CLOSE = b'r', b's', b'c'
+
+# name and dtype of every shared array, each holds one entry per env
+BUFFERS = [('actions', np.int64), ('states', np.int64), ('rewards', np.int64), ('dones', np.bool_),
+           ('final_states', np.int64), ('skipped', np.int64)]
+
+
+def attach_buffers(names, num_envs):
+    """:return: the shared memory blocks and a dict of array views, keyed by buffer name"""
+    blocks, arrays = [], {}
+    for (key, dtype), name in zip(BUFFERS, names):
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        arrays[key] = np.ndarray((num_envs,), dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+def reset_game(game, arrays, i):
+    # Games that end without an agent decision carry no learning signal, so they are replayed as in VecSpinner
+    state, reward, done = game.reset()
+    while done:
+        arrays['skipped'][i] += 1
+        state, reward, done = game.reset()
+    arrays['states'][i] = state
+
+
+def step_games(games, arrays, start):
+    """Plays arrays['actions'][i] in games[i - start], resetting the games that finish."""
+    actions = arrays['actions']
+    for i, game in enumerate(games, start):
+        state, reward, done = game.execute_action(int(actions[i]))
+        arrays['rewards'][i] = reward
+        arrays['dones'][i] = done
+        arrays['final_states'][i] = state
+        if done:
+            reset_game(game, arrays, i)
+        else:
+            arrays['states'][i] = state
+
+
+def reset_games(games, arrays, start):
+    for i, game in enumerate(games, start):
+        reset_game(game, arrays, i)
+        arrays['rewards'][i] = 0
+        arrays['dones'][i] = False
+        arrays['final_states'][i] = arrays['states'][i]
+
+
+def worker(remote, parent_remote, names, num_envs, start, stop, params, seed):
+    """Runs games start to stop - 1 until told to close."""
+    parent_remote.close()
+    blocks, arrays = attach_buffers(names, num_envs)
+    games = [Spinner(dict(params, seed=None if seed is None else seed + i)) for i in range(start, stop)]
+    try:
+        while True:
+            command = remote.recv_bytes()
+            if command == STEP:
+                step_games(games, arrays, start)
+            elif command == RESET:
+                reset_games(games, arrays, start)
+            elif command == CLOSE:
+                break
+            remote.send_bytes(command)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for block in blocks:
+            block.close()
+        remote.close()
+
+
+class SubprocVecSpinner:
+    """
+    Same interface as VecSpinner, with plain Spinner games in worker processes.  Every params of Spinner is supported.
+    Attributes:
+        num_envs: number of games
+        num_workers: number of worker processes, game i runs in worker i * num_workers // num_envs
+        final_states: states at the end of the games that finished on the last step, before they were reset
+        skipped_episodes: games that finished without the agent making a decision.  These are reset and not reported.
+    """
+
+    def __init__(self, params, num_envs, num_workers=None, seed=None, start_method=None):
+        """
+        :param seed: game i is seeded with seed + i, None for fresh entropy
+        :param start_method: multiprocessing start method, None for the platform default
+        """
+        self.params = params
+        self.num_envs = num_envs
+        self.num_workers = min(num_workers or mp.cpu_count(), num_envs)
+        probe = Spinner(params)
+        self.num_actions = probe.get_num_actions()
+        self.num_states = probe.get_num_states()
+        self.waiting = False
+        self.closed = False
+
+        self.blocks = [shared_memory.SharedMemory(create=True, size=num_envs * np.dtype(dtype).itemsize)
+                       for _, dtype in BUFFERS]
+        self.arrays = {key: np.ndarray((num_envs,), dtype=dtype, buffer=block.buf)
+                       for (key, dtype), block in zip(BUFFERS, self.blocks)}
+        for array in self.arrays.values():
+            array[:] = 0
+
+        context = mp.get_context(start_method)
+        bounds = [w * num_envs // self.num_workers for w in range(self.num_workers + 1)]
+        names = [block.name for block in self.blocks]
+        self.remotes, self.processes = [], []
+        for w in range(self.num_workers):
+            remote, worker_remote = context.Pipe()
+            process = context.Process(target=worker, daemon=True,
+                                      args=(worker_remote, remote, names, num_envs, bounds[w], bounds[w + 1],
+                                            params, seed))
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+    def _send(self, command):
+        for remote in self.remotes:
+            remote.send_bytes(command)
+
+    def _wait(self):
+        for remote in self.remotes:
+            remote.recv_bytes()
+        arrays = self.arrays
+        return arrays['states'].copy(), arrays['rewards'].copy(), arrays['dones'].copy()
+
+    def reset(self):
+        """
+        Starts a new game in every environment.
+        :return: states, rewards and done flags, each of shape (num_envs,)
+        """
+        self._send(RESET)
+        return self._wait()
+
+    def step_async(self, actions):
+        """Starts playing the agent actions, the result is collected with step_wait()."""
+        if self.waiting:
+            raise Exception('SubprocVecSpinner.step_async called again before step_wait')
+        self.arrays['actions'][:] = actions
+        self._send(STEP)
+        self.waiting = True
+
+    def step_wait(self):
+        """:return: states, rewards and done flags of the step started by step_async()"""
+        if not self.waiting:
+            raise Exception('SubprocVecSpinner.step_wait called without step_async')
+        self.waiting = False
+        return self._wait()
+
+    def step(self, actions):
+        """
+        Plays the agent action in every game, then the other players until each agent needs to act again.
+        Finished games are reset and their state is the first state of the new game.
+        :param actions: (num_envs,) agent actions, as for Spinner.execute_action
+        :return: states, rewards and done flags, each of shape (num_envs,)
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    @property
+    def final_states(self):
+        return self.arrays['final_states'].copy()
+
+    @property
+    def skipped_episodes(self):
+        return int(self.arrays['skipped'].sum())
+
+    def get_num_actions(self):
+        return self.num_actions
+
+    def get_num_states(self):
+        return self.num_states
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.waiting:
+                self._wait()
+            self._send(CLOSE)
+        except (BrokenPipeError, ConnectionResetError, EOFError):
+            pass  # a worker has died, the others are still joined and the shared memory released
+        self.waiting = False
+        for process in self.processes:
+            process.join()
+        for remote in self.remotes:
+            remote.close()
+        self.arrays = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
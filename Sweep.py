@@ -0,0 +1,218 @@
+"""
+This script runs hyperparameter sweeps over QAgent and Spinner params.
+
+A search space maps each param to a list of values.  Keys in AGENT_PARAMS are passed to QAgent, every other key
+overrides the Spinner params.  The sweep is either the full grid or num_samples configs drawn at random from it.
+Each (config, seed) job trains one agent, and its score is the win rate over the last eval_window episodes.
+
+Jobs are run over a process pool one seed at a time, and every finished job is written to a SQLite results file.
+Running the same sweep again with the same results file skips the jobs already there, so an interrupted sweep is
+resumed by rerunning the command.  After each seed, a config is dropped when the upper end of its confidence interval
+is below the lower end of the best config's interval.
+
+    python Sweep.py sweeps/alpha_gamma.db --space space.json --episodes 2000 --seeds 10
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from Qagent import QAgent
+from Spinner import Spinner
+
+AGENT_PARAMS = ['alpha', 'epsilon', 'gamma', 'eps_to_zero_at']
+
+DEFAULT_PARAMS = {'max_pips': 9,
+                  'spinners': False,
+                  'allow_chickenfeet': False,
+                  'initial_hand_size': 7,
+                  'end_round': 0,
+                  'state_type': 'two_exposed_ends',
+                  'action_space_type': 'hl',
+                  'players': [{'id': 0, 'strategy': 'agent', 'verbose': False},
+                              {'id': 1, 'strategy': 'random', 'verbose': False}],
+                  'verbose': False}
+
+DEFAULT_SPACE = {'alpha': [0.1, 0.3, 0.5],
+                 'epsilon': [0.1, 0.2],
+                 'gamma': [0.9, 0.93, 0.99],
+                 'eps_to_zero_at': [500, 750, 1000]}
+
+# Spinners owned by this process, keyed by their params, created on first use by a job
+worker_games = {}
+
+
+def grid_configs(space):
+    """:return: every combination of the values in space, as a list of dicts"""
+    keys = sorted(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_configs(space, num_samples, seed=0):
+    """:return: num_samples distinct configs drawn uniformly from the grid of space, or the whole grid if smaller"""
+    grid = grid_configs(space)
+    if num_samples >= len(grid):
+        return grid
+    return random.Random(seed).sample(grid, num_samples)
+
+
+def config_id(config):
+    return hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def split_config(config, base_params):
+    """:return: Spinner params and QAgent params for config"""
+    params = dict(base_params)
+    params.update({k: v for k, v in config.items() if k not in AGENT_PARAMS})
+    return params, {k: v for k, v in config.items() if k in AGENT_PARAMS}
+
+
+def run_job(config, params, agent_params, seed, episodes, eval_window):
+    """
+    Trains one QAgent as main.train_agent does, with the Spinner seeded first.
+    :return: config, seed, score, and wall time in seconds
+    """
+    start = time.perf_counter()
+    key = json.dumps(params, sort_keys=True)
+    if key not in worker_games:
+        worker_games[key] = Spinner(params)
+    worker_games[key].seed(seed)
+    agent = QAgent(worker_games[key], verbose=False, **agent_params)
+    wins = agent.learn(episodes)
+    return config, seed, float(np.mean(wins[-eval_window:])), time.perf_counter() - start
+
+
+class SweepStore:
+    """
+    SQLite file holding the result of every finished job.  Only the process running the sweep writes to it.
+    Attributes:
+        path: path of the SQLite file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                          'config_id TEXT, seed INTEGER, config TEXT, settings TEXT, score REAL, elapsed REAL, '
+                          'PRIMARY KEY (config_id, seed, settings))')
+        self.conn.commit()
+
+    def add(self, config, seed, settings, score, elapsed):
+        self.conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                          (config_id(config), seed, json.dumps(config, sort_keys=True), settings, score, elapsed))
+        self.conn.commit()
+
+    def scores(self, settings):
+        """:return: dict from config id to {seed: score} for the jobs run with settings"""
+        scores = {}
+        for cid, seed, score in self.conn.execute('SELECT config_id, seed, score FROM results WHERE settings = ?',
+                                                  (settings,)):
+            scores.setdefault(cid, {})[seed] = score
+        return scores
+
+    def close(self):
+        self.conn.close()
+
+
+def confidence_interval(scores, z=1.96):
+    """:return: mean and half width of the normal confidence interval of the mean of scores, (nan, inf) if empty"""
+    n = len(scores)
+    if n == 0:
+        return math.nan, math.inf
+    mean = sum(scores) / n
+    if n < 2:
+        return mean, math.inf
+    var = sum((s - mean) ** 2 for s in scores) / (n - 1)
+    return mean, z * math.sqrt(var / n)
+
+
+def select_survivors(configs, scores, min_seeds=3, z=1.96):
+    """
+    Early stopping rule.  Configs with fewer than min_seeds scores always survive.
+    :return: the configs whose confidence interval reaches the lower bound of the best config's interval
+    """
+    bounds = {}
+    for config in configs:
+        s = list(scores.get(config_id(config), {}).values())
+        if len(s) >= min_seeds:
+            mean, half = confidence_interval(s, z)
+            bounds[config_id(config)] = (mean - half, mean + half)
+    if not bounds:
+        return configs
+    best_lower = max(lower for lower, upper in bounds.values())
+    return [c for c in configs if config_id(c) not in bounds or bounds[config_id(c)][1] >= best_lower]
+
+
+def run_sweep(store_path, configs, base_params=None, episodes=2000, num_seeds=10, seed=0, eval_window=100,
+              min_seeds=3, z=1.96, num_workers=1):
+    """
+    Runs num_seeds seeds of every config, seed + k for the k-th seed, dropping configs that are clearly worse than
+    the best one.  Jobs already in the results store with the same settings are not run again.
+    :return: list of (config, mean score, confidence half width, number of seeds), best first
+    """
+    base_params = base_params or DEFAULT_PARAMS
+    settings = json.dumps({'params': base_params, 'episodes': episodes, 'eval_window': eval_window},
+                          sort_keys=True)
+    store = SweepStore(store_path)
+    alive = list(configs)
+    pool = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+    try:
+        for k in range(num_seeds):
+            scores = store.scores(settings)
+            alive = select_survivors(alive, scores, min_seeds, z)
+            jobs = [c for c in alive if seed + k not in scores.get(config_id(c), {})]
+            print(f'Seed {k + 1} of {num_seeds}: {len(alive)} configs alive, {len(jobs)} jobs to run')
+            args = [(c, *split_config(c, base_params), seed + k, episodes, eval_window) for c in jobs]
+            results = (map(lambda a: run_job(*a), args) if pool is None else
+                       (f.result() for f in as_completed([pool.submit(run_job, *a) for a in args])))
+            for config, job_seed, score, elapsed in results:
+                store.add(config, job_seed, settings, score, elapsed)
+
+        scores = store.scores(settings)
+        summary = []
+        for config in configs:
+            s = list(scores.get(config_id(config), {}).values())
+            summary.append((config, *confidence_interval(s, z), len(s)))
+        summary.sort(key=lambda r: (r[3] > 0, r[1] if r[3] > 0 else 0), reverse=True)  # configs never run last
+        return summary
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resumable QAgent hyperparameter sweep')
+    parser.add_argument('store', help='SQLite results file, reused to resume a sweep')
+    parser.add_argument('--space', help='JSON file mapping each param to a list of values')
+    parser.add_argument('--samples', type=int, help='random search over this many configs instead of the grid')
+    parser.add_argument('--episodes', type=int, default=2000)
+    parser.add_argument('--seeds', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--eval-window', type=int, default=100, help='score is the win rate over the last episodes')
+    parser.add_argument('--min-seeds', type=int, default=3, help='seeds run before a config can be dropped')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    configs = grid_configs(space) if args.samples is None else random_configs(space, args.samples, args.seed)
+    summary = run_sweep(args.store, configs, DEFAULT_PARAMS, args.episodes, args.seeds, args.seed, args.eval_window,
+                        args.min_seeds, num_workers=args.workers)
+    print()
+    for config, mean, half, n in summary:
+        print(f'{mean:.3f} +- {half:.3f} ({n} seeds) {config}')
+
+
+if __name__ == '__main__':
+    main()
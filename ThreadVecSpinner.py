@@ -0,0 +1,169 @@
+"""
+This script contains a vectorized Spinner environment that steps its games on a thread pool in this process.
+
+It has the interface of SubprocVecSpinner.  num_envs Spinner games are split into num_threads chunks, and each step
+runs one chunk per thread of a ThreadPoolExecutor.  A game holds all of its state, players, random generator, board
+and tiles included, and only shares the read-only tile tables of TileSet.shared, so many games can be hosted and
+stepped side by side.  Game code is pure Python and holds the GIL, so on a standard build the threads overlap the
+games with other work, such as the agent between step_async and step_wait, rather than running them in parallel.
+
+Run as a script, it steps hundreds of games on threads and checks each one against the same game stepped alone:
+
+    python ThreadVecSpinner.py --games 512 --threads 8 --steps 300
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from Spinner import Spinner
+from SubprocVecSpinner import BUFFERS, reset_games, step_games
+
+DEFAULT_PARAMS = {'max_pips': 9,
+                  'spinners': False,
+                  'allow_chickenfeet': False,
+                  'initial_hand_size': 7,
+                  'end_round': 0,
+                  'state_type': 'two_exposed_ends',
+                  'action_space_type': 'hl',
+                  'players': [{'id': 0, 'strategy': 'agent', 'verbose': False},
+                              {'id': 1, 'strategy': 'random', 'verbose': False}],
+                  'verbose': False}
+
+
+class ThreadVecSpinner:
+    """
+    Same interface as SubprocVecSpinner, with the games in this process.
+    Attributes:
+        num_envs: number of games
+        num_threads: number of threads, each steps a contiguous chunk of games
+        games: the Spinner games, game i is seeded with seed + i
+        final_states: states at the end of the games that finished on the last step, before they were reset
+        skipped_episodes: games that finished without the agent making a decision.  These are reset and not reported.
+    """
+
+    def __init__(self, params, num_envs, num_threads=8, seed=None):
+        """:param seed: game i is seeded with seed + i, None for fresh entropy"""
+        self.params = params
+        self.num_envs = num_envs
+        self.num_threads = min(num_threads, num_envs)
+        self.games = [Spinner(dict(params, seed=None if seed is None else seed + i)) for i in range(num_envs)]
+        self.num_actions = self.games[0].get_num_actions()
+        self.num_states = self.games[0].get_num_states()
+        self.arrays = {key: np.zeros(num_envs, dtype=dtype) for key, dtype in BUFFERS}
+        bounds = [t * num_envs // self.num_threads for t in range(self.num_threads + 1)]
+        self.chunks = list(zip(bounds[:-1], bounds[1:]))
+        self.pool = ThreadPoolExecutor(max_workers=self.num_threads)
+        self.pending = None
+
+    def _submit(self, function):
+        self.pending = [self.pool.submit(function, self.games[start:stop], self.arrays, start)
+                        for start, stop in self.chunks]
+
+    def _wait(self):
+        pending, self.pending = self.pending, None
+        for future in pending:
+            future.result()  # raises the exception of a failed chunk
+        arrays = self.arrays
+        return arrays['states'].copy(), arrays['rewards'].copy(), arrays['dones'].copy()
+
+    def reset(self):
+        """
+        Starts a new game in every environment.
+        :return: states, rewards and done flags, each of shape (num_envs,)
+        """
+        if self.pending is not None:
+            self._wait()
+        self._submit(reset_games)
+        return self._wait()
+
+    def step_async(self, actions):
+        """Starts playing the agent actions, the result is collected with step_wait()."""
+        if self.pending is not None:
+            raise Exception('ThreadVecSpinner.step_async called again before step_wait')
+        self.arrays['actions'][:] = actions
+        self._submit(step_games)
+
+    def step_wait(self):
+        """:return: states, rewards and done flags of the step started by step_async()"""
+        if self.pending is None:
+            raise Exception('ThreadVecSpinner.step_wait called without step_async')
+        return self._wait()
+
+    def step(self, actions):
+        """
+        Plays the agent action in every game, then the other players until each agent needs to act again.
+        Finished games are reset and their state is the first state of the new game.
+        :param actions: (num_envs,) agent actions, as for Spinner.execute_action
+        :return: states, rewards and done flags, each of shape (num_envs,)
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    @property
+    def final_states(self):
+        return self.arrays['final_states'].copy()
+
+    @property
+    def skipped_episodes(self):
+        return int(self.arrays['skipped'].sum())
+
+    def get_num_actions(self):
+        return self.num_actions
+
+    def get_num_states(self):
+        return self.num_states
+
+    def close(self):
+        if self.pending is not None:
+            self._wait()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stress_check(params, num_envs=256, num_threads=8, steps=300, seed=0):
+    """
+    Steps num_envs games on threads, and the same games one after another in this thread, with the same random
+    actions.  Raises an exception at the first state, reward or done flag that differs.
+    :return: number of game steps compared
+    """
+    rng = np.random.default_rng(seed)
+    alone = [Spinner(dict(params, seed=seed + i)) for i in range(num_envs)]
+    arrays = {key: np.zeros(num_envs, dtype=dtype) for key, dtype in BUFFERS}
+    with ThreadVecSpinner(params, num_envs, num_threads, seed) as env:
+        results = env.reset()
+        reset_games(alone, arrays, 0)
+        for step in range(steps + 1):
+            expected = (arrays['states'], arrays['rewards'], arrays['dones'])
+            for name, got, want in zip(['state', 'reward', 'done'], results, expected):
+                differ = np.flatnonzero(got != want)
+                if differ.size:
+                    raise Exception(f'ThreadVecSpinner stress check, game {differ[0]} {name} differs at step {step}: '
+                                    f'{got[differ[0]]} on threads, {want[differ[0]]} alone')
+            if step == steps:
+                break
+            actions = rng.integers(env.num_actions, size=num_envs)
+            results = env.step(actions)
+            arrays['actions'][:] = actions
+            step_games(alone, arrays, 0)
+    return num_envs * steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that games stepped on threads match games stepped alone')
+    parser.add_argument('--games', type=int, default=256)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    compared = stress_check(DEFAULT_PARAMS, args.games, args.threads, args.steps, args.seed)
+    print(f'{compared} game steps on {args.threads} threads match the games stepped alone')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,10 @@
 
 class Tile:
     """
-    Represents a single tile in the game of Spinner.
+    Represents a single tile in the game of Spinner.  Tiles are made once per TileSet and shared by every game using
+    it, so they must never be modified.
     Attributes:
+        id: position of the tile in its TileSet, 0 to n - 1
         low, high: the value of each end of the tile.  These are always ordered from low to high except for doubles
                     'S' is for spinner and is always the high end.
         is_spinner: True if the tile has a spinner
@@ -13,17 +15,16 @@ class Tile:
         spinner_value: the value of a spinner end for points
     """
 
-    num_tiles = 0
+    __slots__ = ('id', 'low', 'high', 'is_spinner', 'is_double', 'value')
+    spinner_value = 10
 
-    def __init__(self, low, high):
-        self.id = Tile.num_tiles
-        Tile.num_tiles += 1
+    def __init__(self, low, high, id=0):
+        self.id = id
         self.low = low
         self.high = high
         self.is_spinner = 'S' in [self.low, self.high]
         self.is_double = self.high == self.low
         self.value = 0
-        self.spinner_value = 10
 
         # Ensure low is low and high is high
         if self.is_spinner:
@@ -1,28 +1,63 @@
 """This script contains the classes used in the Spinner game."""
-import random
+import threading
 from itertools import combinations_with_replacement
+
+import numpy as np
+
 from Tile import Tile
 
 
 class TileSet:
     """
-    Represents a full set of tiles for the game of Spinner
+    Represents a full set of tiles for the game of Spinner.  Games get their tiles from TileSet.shared(), so every game
+    with the same max_pips and spinners uses the same Tile objects and arrays.
 
     Attributes:
-        tiles: the full set of tiles in the game
+        tiles: tuple of the full set of tiles, tiles[i].id == i
+        lows, highs: end values of each tile, with the 'S' spinner end stored as max_pips + 1
+        values: value of each tile
+        is_double, is_spinner: flags of each tile
+        The arrays are indexed by tile id and read-only.
 
     Methods:
-        shuffle(): shuffles the tiles in place
+        shared(): the TileSet of a configuration, made on first use
+        shuffled(): the tiles in random order
     """
+    shared_sets = {}  # (max_pips, spinners) to TileSet
+    shared_lock = threading.Lock()
 
     def __init__(self, max_pips=9, spinners=True):
         ends = list(range(max_pips + 1))
         if spinners:
             ends.append('S')
-        self.tiles = [Tile(low, high) for low, high in combinations_with_replacement(ends, 2)]
+        self.max_pips = max_pips
+        self.spinners = spinners
+        self.tiles = tuple(Tile(low, high, i) for i, (low, high) in enumerate(combinations_with_replacement(ends, 2)))
+
+        spinner_end = max_pips + 1
+        self.lows = np.array([spinner_end if t.low == 'S' else t.low for t in self.tiles], dtype=np.int64)
+        self.highs = np.array([spinner_end if t.high == 'S' else t.high for t in self.tiles], dtype=np.int64)
+        self.values = np.array([t.value for t in self.tiles], dtype=np.int64)
+        self.is_double = np.array([t.is_double for t in self.tiles])
+        self.is_spinner = np.array([t.is_spinner for t in self.tiles])
+        for array in (self.lows, self.highs, self.values, self.is_double, self.is_spinner):
+            array.flags.writeable = False
+
+    @classmethod
+    def shared(cls, max_pips=9, spinners=True) -> 'TileSet':
+        key = (max_pips, bool(spinners))
+        tile_set = cls.shared_sets.get(key)
+        if tile_set is None:
+            with cls.shared_lock:
+                tile_set = cls.shared_sets.setdefault(key, cls(max_pips, spinners))
+        return tile_set
+
+    def shuffled(self, rng) -> list:
+        """:param rng: numpy Generator, such as the game's"""
+        return [self.tiles[i] for i in rng.permutation(len(self.tiles))]
 
-    def shuffle(self):
-        random.shuffle(self.tiles)
+    def __len__(self):
+        return len(self.tiles)
 
     def __str__(self):
         return ' '.join(map(str, self.tiles))
@@ -0,0 +1,185 @@
+"""
+This script runs round-robin tournaments between the built-in strategies and saved Q-policies, without any output
+from the games.
+
+An entrant is 'random', 'play_high', 'play_low', or the path of a q_table saved with np.save, which plays its greedy
+action from an agent seat.  Every ordered seating of num_seats different entrants plays games_per_seating games.
+Game g of every seating is played with seed + g, so the seatings are compared on the same deals.
+
+The results are two matrices over the entrants, each with a confidence half width:
+    win_rate[i, j]: share of the games with both i and j seated in which i scored less than j, ties count half
+    avg_score[i, j]: average score total of i in the games with both i and j seated
+and the overall win rate of each entrant, a game won by k tied players counting 1/k for each.
+
+    python Tournament.py random play_high play_low agent.npy --games 2000 --seats 2
+"""
+import argparse
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from Evaluation import greedy_actions
+from Spinner import Spinner
+
+BUILT_IN_STRATEGIES = ['random', 'play_high', 'play_low']
+
+# Spinners owned by this process, keyed by seating, created on first use
+worker_games = {}
+
+
+class TournamentResult(NamedTuple):
+    entrants: list
+    games: np.ndarray  # games[i, j], games with both i and j seated, the diagonal counts the games of i
+    win_rate: np.ndarray
+    win_rate_half_width: np.ndarray
+    avg_score: np.ndarray
+    avg_score_half_width: np.ndarray
+    overall_win_rate: np.ndarray
+    overall_half_width: np.ndarray
+
+
+def seating_params(base_params, seating):
+    players = [{'id': seat, 'strategy': name if name in BUILT_IN_STRATEGIES else 'agent', 'verbose': False}
+               for seat, name in enumerate(seating)]
+    return dict(base_params, players=players, verbose=False)
+
+
+def play_seating(base_params, seating, policies, seeds):
+    """
+    Plays one game per seed with entrant seating[s] in seat s.
+    :param policies: dict from Q-policy entrant to its greedy action array
+    :return: (len(seeds), num_seats) array of score totals
+    """
+    if seating not in worker_games:
+        worker_games[seating] = Spinner(seating_params(base_params, seating))
+    game = worker_games[seating]
+    seat_policies = [policies.get(name) for name in seating]
+    scores = np.zeros((len(seeds), len(seating)))
+    for g, seed in enumerate(seeds):
+        game.seed(seed)
+        state, reward, done = game.reset()
+        while not done:
+            seat = game.current_player.id
+            state, reward, done = game.execute_action(int(seat_policies[seat][state]))
+        scores[g] = game.calc_score_totals()
+    return scores
+
+
+def mean_and_half_width(values, z=1.96):
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return (float(values.mean()) if len(values) else math.nan), math.inf
+    return float(values.mean()), z * float(values.std(ddof=1)) / math.sqrt(len(values))
+
+
+def summarize(entrants, results, z=1.96):
+    """
+    :param results: dict from seating to its (games, num_seats) score totals
+    :return: TournamentResult
+    """
+    n = len(entrants)
+    pair_wins = [[[] for _ in range(n)] for _ in range(n)]
+    pair_scores = [[[] for _ in range(n)] for _ in range(n)]
+    overall = [[] for _ in range(n)]
+    index = {name: i for i, name in enumerate(entrants)}
+    for seating, scores in results.items():
+        seats = [index[name] for name in seating]
+        winners = scores == scores.min(axis=1, keepdims=True)
+        share = winners / winners.sum(axis=1, keepdims=True)
+        for a, i in enumerate(seats):
+            overall[i].extend(share[:, a])
+            pair_scores[i][i].extend(scores[:, a])
+            for b, j in enumerate(seats):
+                if a != b:
+                    pair_wins[i][j].extend((scores[:, a] < scores[:, b]) + 0.5 * (scores[:, a] == scores[:, b]))
+                    pair_scores[i][j].extend(scores[:, a])
+
+    games = np.array([[len(pair_scores[i][j]) for j in range(n)] for i in range(n)])
+    win_rate, win_half = np.full((n, n), math.nan), np.full((n, n), math.nan)
+    avg_score, score_half = np.full((n, n), math.nan), np.full((n, n), math.nan)
+    for i in range(n):
+        for j in range(n):
+            if pair_wins[i][j]:
+                win_rate[i, j], win_half[i, j] = mean_and_half_width(pair_wins[i][j], z)
+            if pair_scores[i][j]:
+                avg_score[i, j], score_half[i, j] = mean_and_half_width(pair_scores[i][j], z)
+    overall_rate, overall_half = zip(*(mean_and_half_width(o, z) for o in overall))
+    return TournamentResult(list(entrants), games, win_rate, win_half, avg_score, score_half,
+                            np.array(overall_rate), np.array(overall_half))
+
+
+def run_tournament(base_params, entrants, num_seats=2, games_per_seating=1000, seed=0, batch_size=250,
+                   num_workers=1, z=1.96):
+    """
+    Plays games_per_seating games for every ordered seating of num_seats different entrants.
+    :param base_params: Spinner params without players.  state_type and action_space_type must match the Q-policies.
+    :return: TournamentResult
+    """
+    if len(set(entrants)) != len(entrants):
+        raise Exception(f'Tournament entrants must be unique, got {entrants}')
+    if num_seats > len(entrants):
+        raise Exception(f'Cannot seat {num_seats} players from {len(entrants)} entrants')
+    policies = {name: greedy_actions(np.load(name)) for name in entrants if name not in BUILT_IN_STRATEGIES}
+    seatings = list(itertools.permutations(entrants, num_seats))
+    jobs = [(seating, list(range(seed + start, seed + min(start + batch_size, games_per_seating))))
+            for seating in seatings for start in range(0, games_per_seating, batch_size)]
+
+    if num_workers == 1:
+        scores = [play_seating(base_params, seating, policies, seeds) for seating, seeds in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            scores = list(pool.map(play_seating, [base_params] * len(jobs), [s for s, _ in jobs],
+                                   [policies] * len(jobs), [seeds for _, seeds in jobs]))
+    results = {seating: np.concatenate([s for (job_seating, _), s in zip(jobs, scores) if job_seating == seating])
+               for seating in seatings}
+    return summarize(entrants, results, z)
+
+
+def print_matrix(title, entrants, values, half_widths, fmt):
+    names = [os.path.basename(e) for e in entrants]
+    width = max(14, max(len(n) for n in names) + 1)
+    print(title)
+    print(' ' * width + ''.join(f'{n:>{2 * width}s}' for n in names))
+    for name, row, half_row in zip(names, values, half_widths):
+        cells = ['-' if math.isnan(v) else f'{v:{fmt}} +- {h:{fmt}}' for v, h in zip(row, half_row)]
+        print(f'{name:<{width}s}' + ''.join(f'{c:>{2 * width}s}' for c in cells))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Round-robin tournament between strategies and saved Q-policies')
+    parser.add_argument('entrants', nargs='+', help=f'{", ".join(BUILT_IN_STRATEGIES)} or q_table .npy files')
+    parser.add_argument('--seats', type=int, default=2)
+    parser.add_argument('--games', type=int, default=1000, help='games per seating')
+    parser.add_argument('--max-pips', type=int, default=9)
+    parser.add_argument('--end-round', type=int, default=0)
+    parser.add_argument('--state-type', choices=['two_exposed_ends', 'one_state'], default='two_exposed_ends')
+    parser.add_argument('--action-space', default='hl')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    base_params = {'max_pips': args.max_pips,
+                   'spinners': False,
+                   'allow_chickenfeet': False,
+                   'initial_hand_size': 7,
+                   'end_round': args.end_round,
+                   'state_type': args.state_type,
+                   'action_space_type': args.action_space}
+    result = run_tournament(base_params, args.entrants, args.seats, args.games, args.seed,
+                            num_workers=args.workers)
+    print_matrix('Win rate of row against column', result.entrants, result.win_rate, result.win_rate_half_width,
+                 '.3f')
+    print_matrix('Average score total of row with column seated', result.entrants, result.avg_score,
+                 result.avg_score_half_width, '.1f')
+    print('Overall win rate')
+    for name, rate, half in zip(result.entrants, result.overall_win_rate, result.overall_half_width):
+        print(f'  {name}: {rate:.3f} +- {half:.3f}')
+
+
+if __name__ == '__main__':
+    main()
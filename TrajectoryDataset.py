@@ -0,0 +1,203 @@
+"""
+This script generates offline datasets of (state, action, reward, next_state, done) transitions from Spinner games
+and loads them back without reading them into memory.
+
+The agent seat is played by a behaviour policy, the other seats by their strategies in params.  Transitions are written
+to fixed-size shards, each a structured .npy file, and listed in index.json as each shard finishes.  Shard k is always
+generated with seed + k, so an interrupted run is resumed by running the same command again: finished shards are kept
+and the rest are generated.
+
+    python TrajectoryDataset.py data/random_vs_high --behaviour random --shards 100 --shard-size 1000000
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from Spinner import ACTION_KEYS, Spinner
+
+TRANSITION_DTYPE = np.dtype([('state', '<i2'),
+                             ('action', 'i1'),
+                             ('reward', '<f4'),
+                             ('next_state', '<i2'),
+                             ('done', '?')])
+INDEX_FILE = 'index.json'
+BEHAVIOURS = ['random', 'play_high', 'play_low', 'uniform']
+
+# Spinner owned by this process, created once per worker by init_worker
+worker_game = None
+
+
+def init_worker(params):
+    global worker_game
+    worker_game = Spinner(params)
+
+
+def behaviour_policy(game, behaviour):
+    """
+    :param behaviour: a built-in strategy, played through the agent action that maps to it, or 'uniform' for an
+                      action chosen uniformly at random with the game's generator
+    :return: function from state to action
+    """
+    if behaviour == 'uniform':
+        actions = range(len(ACTION_KEYS[game.action_space_type]))
+        return lambda state: game.choice(actions)
+    actions = [a for a, s in ACTION_KEYS[game.action_space_type].items() if s == behaviour]
+    if not actions:
+        raise Exception(f'Behaviour {behaviour} is not an action in action space {game.action_space_type}')
+    return lambda state: actions[0]
+
+
+def shard_name(shard_index):
+    return f'shard_{shard_index:05d}.npy'
+
+
+def generate_shard(out_dir, shard_index, shard_size, seed, behaviour):
+    """
+    Fills one shard with shard_size transitions.  The shard is written to a temporary file and renamed when complete,
+    so a shard file that exists is always whole.  The last episode in a shard is cut off without a done flag.
+    :return: shard index, file name, and number of episodes started
+    """
+    game = worker_game
+    game.seed(seed)
+    policy = behaviour_policy(game, behaviour)
+    name = shard_name(shard_index)
+    tmp_path = os.path.join(out_dir, name + '.tmp')
+    shard = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=TRANSITION_DTYPE, shape=(shard_size,))
+
+    i = episodes = 0
+    done = True
+    while i < shard_size:
+        if done:
+            state, reward, done = game.reset()
+            episodes += 1
+            continue
+        action = policy(state)
+        next_state, reward, done = game.execute_action(action)
+        shard[i] = (state, action, reward, next_state, done)
+        state = next_state
+        i += 1
+
+    shard.flush()
+    del shard
+    os.replace(tmp_path, os.path.join(out_dir, name))
+    return shard_index, name, episodes
+
+
+def load_index(out_dir):
+    path = os.path.join(out_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_index(out_dir, index):
+    path = os.path.join(out_dir, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def generate_dataset(out_dir, params, behaviour='random', num_shards=10, shard_size=100_000, seed=0, num_workers=1):
+    """
+    Generates num_shards shards of shard_size transitions in out_dir, resuming a previous run with the same settings.
+    :return: the dataset index
+    """
+    if behaviour not in BEHAVIOURS:
+        raise ValueError(f'Unknown behaviour {behaviour}, must be one of {BEHAVIOURS}')
+    os.makedirs(out_dir, exist_ok=True)
+    settings = {'params': params, 'behaviour': behaviour, 'shard_size': shard_size, 'seed': seed,
+                'state_type': params['state_type'], 'action_space_type': params['action_space_type'],
+                'dtype': TRANSITION_DTYPE.descr}
+    index = load_index(out_dir)
+    if index is None:
+        index = dict(settings, shards={})
+    elif any(index[k] != json.loads(json.dumps(v)) for k, v in settings.items()):
+        raise Exception(f'{out_dir} holds a dataset generated with different settings')
+
+    todo = [k for k in range(num_shards) if str(k) not in index['shards']
+            or not os.path.exists(os.path.join(out_dir, index['shards'][str(k)]['file']))]
+    print(f'{num_shards - len(todo)} of {num_shards} shards already done, generating {len(todo)}')
+
+    def finished(result):
+        shard_index, name, episodes = result
+        index['shards'][str(shard_index)] = {'file': name, 'count': shard_size, 'episodes': episodes,
+                                             'seed': seed + shard_index}
+        write_index(out_dir, index)
+        print(f'Shard {shard_index} done')
+
+    if num_workers == 1:
+        init_worker(params)
+        for k in todo:
+            finished(generate_shard(out_dir, k, shard_size, seed + k, behaviour))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=(params,)) as pool:
+            futures = [pool.submit(generate_shard, out_dir, k, shard_size, seed + k, behaviour) for k in todo]
+            for future in as_completed(futures):
+                finished(future.result())
+    return index
+
+
+class TrajectoryDataset:
+    """
+    Read-only view of a generated dataset.  Shards are memory-mapped, so nothing is read until it is used.
+    Attributes:
+        index: the dataset index
+        shards: list of memory-mapped structured arrays with the fields of TRANSITION_DTYPE
+    """
+
+    def __init__(self, out_dir):
+        self.index = load_index(out_dir)
+        if self.index is None:
+            raise Exception(f'No {INDEX_FILE} in {out_dir}')
+        entries = [self.index['shards'][k] for k in sorted(self.index['shards'], key=int)]
+        self.shards = [np.load(os.path.join(out_dir, e['file']), mmap_mode='r') for e in entries]
+        self.offsets = np.cumsum([0] + [len(s) for s in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        k = int(np.searchsorted(self.offsets, i, side='right')) - 1
+        return self.shards[k][i - self.offsets[k]]
+
+    def iter_batches(self, batch_size):
+        """Yields consecutive batches as views into the shards, a batch never spans two shards."""
+        for shard in self.shards:
+            for start in range(0, len(shard), batch_size):
+                yield shard[start:start + batch_size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate an offline Spinner transition dataset')
+    parser.add_argument('out_dir')
+    parser.add_argument('--behaviour', choices=BEHAVIOURS, default='random')
+    parser.add_argument('--opponents', nargs='+', default=['random'], help='strategies of the other seats')
+    parser.add_argument('--state-type', choices=['two_exposed_ends', 'one_state'], default='two_exposed_ends')
+    parser.add_argument('--action-space', choices=list(ACTION_KEYS), default='hrl')
+    parser.add_argument('--shards', type=int, default=10)
+    parser.add_argument('--shard-size', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    params = {'max_pips': 9,
+              'spinners': False,
+              'allow_chickenfeet': False,
+              'initial_hand_size': 7,
+              'end_round': 0,
+              'state_type': args.state_type,
+              'action_space_type': args.action_space,
+              'players': [{'id': 0, 'strategy': 'agent', 'verbose': False}] +
+                         [{'id': i + 1, 'strategy': s, 'verbose': False} for i, s in enumerate(args.opponents)],
+              'verbose': False}
+    generate_dataset(args.out_dir, params, args.behaviour, args.shards, args.shard_size, args.seed, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+"""This script contains a batched version of the Spinner environment that steps many games at once."""
+import numpy as np
+
+from Spinner import ACTION_KEYS
+from TileSet import TileSet
+
+# Codes for the built-in strategies, used to pick plays for many games at once
+STRATEGY_CODES = {'random': 0, 'play_high': 1, 'play_low': 2}
+
+
+class VecSpinner:
+    """
+    Runs num_envs independent Spinner games in lockstep.  Hands, boneyards and boards are held in NumPy arrays indexed
+    by tile number (the position of the tile in TileSet) so each turn is played for every game with array operations.
+    The rules follow Spinner, Board.receive_tile and Player.get_valid_plays, including duplicate entries in the valid
+    plays (e.g. x|S on end x), which weight the 'random' strategy.  Games are reset automatically when they finish.
+
+    Attributes:
+        num_envs: number of games stepped together
+        hands: (num_envs, num_players, num_tiles) bool, tiles in each player's hand
+        boneyard: (num_envs, num_tiles) bool, tiles left in each boneyard
+        board_count: (num_envs,) number of tiles on each board
+        exposed_ends: (num_envs, max_pips + 1) number of exposed ends of each pip value
+        exposed_double: (num_envs,) pip value of the exposed double.  0 means no exposed double, Board also treats
+                        an exposed 0|0 as no exposed double
+        exposed_double_count: (num_envs,) tiles played on the exposed double
+        round: (num_envs,) current round of each game
+        current_player: (num_envs,) seat index of the player to move
+        score_totals: (num_envs, num_players) scores summed over finished rounds
+        game_done: (num_envs,) True once the last round is scored
+        final_states: states at the end of the games that finished on the last step, before they were reset
+        skipped_episodes: games that finished without the agent making a decision.  These are reset and not reported.
+    """
+
+    def __init__(self, params, num_envs, seed=None):
+        strategies = [p['strategy'] for p in params['players']]
+        if strategies.count('agent') != 1:
+            raise Exception(f'VecSpinner needs exactly one agent player, strategies are {strategies}')
+        for s in strategies:
+            if s != 'agent' and s not in STRATEGY_CODES:
+                raise ValueError(f'VecSpinner - Unsupported player strategy {s}')
+        if params['action_space_type'] not in ACTION_KEYS:
+            raise Exception(f'Invalid action space type {params["action_space_type"]}')
+
+        self.params = params
+        self.num_envs = num_envs
+        self.num_players = len(strategies)
+        self.max_pips = params['max_pips']
+        self.spinners = params['spinners']
+        self.allow_chickenfeet = params['allow_chickenfeet']
+        self.tiles_per_double = 3 if self.allow_chickenfeet else 1
+        self.state_type = params['state_type']
+        self.action_space_type = params['action_space_type']
+        self.starting_round = self.max_pips
+        self.ending_round = params['end_round']
+        self.init_hand_size = params['initial_hand_size']
+        self.rng = np.random.default_rng(seed)
+
+        self.agent_seat = strategies.index('agent')
+        self.strategy_codes = np.array([STRATEGY_CODES.get(s, -1) for s in strategies])
+        self.action_codes = np.array([STRATEGY_CODES[s] for s in ACTION_KEYS[self.action_space_type].values()])
+
+        self._build_tile_tables()
+        if self.num_players * self.init_hand_size > self.num_tiles:
+            raise Exception(f'Cannot deal {self.init_hand_size} tiles to {self.num_players} players '
+                            f'from {self.num_tiles} tiles')
+
+        n, p, t, e = num_envs, self.num_players, self.num_tiles, self.num_ends
+        self.hands = np.zeros((n, p, t), dtype=bool)
+        self.boneyard = np.zeros((n, t), dtype=bool)
+        self.board_count = np.zeros(n, dtype=np.int64)
+        self.exposed_ends = np.zeros((n, e), dtype=np.int64)
+        self.exposed_double = np.zeros(n, dtype=np.int64)
+        self.exposed_double_count = np.zeros(n, dtype=np.int64)
+        self.round = np.zeros(n, dtype=np.int64)
+        self.current_player = np.zeros(n, dtype=np.int64)
+        self.score_totals = np.zeros((n, p), dtype=np.int64)
+        self.game_done = np.zeros(n, dtype=bool)
+        self.final_states = np.zeros(n, dtype=np.int64)
+        self.skipped_episodes = 0
+
+    def _build_tile_tables(self):
+        """
+        Builds the lookup tables used in place of Tile objects.  Tile numbers are positions in TileSet.tiles.
+            end_multiplicity[t, e]: number of entries Player.get_valid_plays yields for tile t on usable end e
+            tile_value: value of each tile
+            other_end[t, e]: end that replaces e in Board.exposed_ends when tile t is played on e
+            opening_tiles[r, t]: tile t can start round r (r|r or S|S)
+        """
+        tiles = TileSet.shared(self.max_pips, self.spinners).tiles
+        self.num_tiles = len(tiles)
+        self.num_ends = self.max_pips + 1
+        self.tile_value = np.array([t.value for t in tiles], dtype=np.int64)
+        self.tile_is_double = np.array([t.is_double for t in tiles])
+        self.double_tiles = np.flatnonzero(self.tile_is_double)
+        self.end_multiplicity = np.zeros((self.num_tiles, self.num_ends), dtype=np.int16)
+        self.other_end = np.full((self.num_tiles, self.num_ends), -1, dtype=np.int64)
+        self.opening_tiles = np.zeros((self.num_ends, self.num_tiles), dtype=bool)
+
+        for i, tile in enumerate(tiles):
+            for e in range(self.num_ends):
+                self.end_multiplicity[i, e] = ((tile.low == e) + (tile.high == e and not tile.is_double)
+                                               + (tile.high == 'S'))
+                if tile.is_double:
+                    self.opening_tiles[e, i] = tile.high in [e, 'S']
+                elif tile.is_spinner:
+                    self.other_end[i, e] = tile.low
+                elif e == tile.low:
+                    self.other_end[i, e] = tile.high
+                elif e == tile.high:
+                    self.other_end[i, e] = tile.low
+
+    def reset(self):
+        """
+        Starts a new game in every environment and plays until each agent needs to choose an action.
+        :return: states, rewards and done flags, each of shape (num_envs,)
+        """
+        self._start_games(np.arange(self.num_envs))
+        return self.get_states(), np.zeros(self.num_envs, dtype=np.int64), self.game_done.copy()
+
+    def step(self, actions):
+        """
+        Plays the agent action in every game, then plays the other players until each agent needs to act again.
+        Finished games are reset and their state is the first state of the new game.  The state at the end of a
+        finished game is kept in final_states.
+        :param actions: (num_envs,) agent actions, as for Spinner.execute_action
+        :return: states, rewards and done flags, each of shape (num_envs,)
+        """
+        idx = np.arange(self.num_envs)
+        if np.any(self.current_player != self.agent_seat):
+            raise Exception('Cannot step VecSpinner unless the current player is the agent in every game')
+
+        self._play_turns(idx, self.action_codes[np.asarray(actions)])
+        self._end_turns(idx)
+        self._advance(idx[~self.game_done])
+
+        dones = self.game_done.copy()
+        winners = np.argmin(self.score_totals, axis=1)
+        rewards = np.where(dones & (winners == self.agent_seat), 100, 0)
+        states = self.get_states()
+        self.final_states = states.copy()
+        if dones.any():
+            done_idx = np.flatnonzero(dones)
+            self._start_games(done_idx)
+            states[done_idx] = self.get_states()[done_idx]
+        return states, rewards, dones
+
+    def _start_games(self, idx):
+        # Games that end without an agent decision carry no learning signal, so they are replayed
+        while idx.size:
+            self.round[idx] = self.starting_round
+            self.score_totals[idx] = 0
+            self.game_done[idx] = False
+            self._deal(idx)
+            self.current_player[idx] = self.rng.integers(self.num_players, size=idx.size)
+            self._advance(idx)
+            idx = idx[self.game_done[idx]]
+            self.skipped_episodes += idx.size
+
+    def _deal(self, idx):
+        order = np.argsort(self.rng.random((idx.size, self.num_tiles)), axis=1)
+        size = self.init_hand_size
+        rows = idx[:, None]
+        self.hands[idx] = False
+        for p in range(self.num_players):
+            self.hands[rows, p, order[:, p * size:(p + 1) * size]] = True
+        self.boneyard[idx] = True
+        self.boneyard[rows, order[:, :self.num_players * size]] = False
+        self.board_count[idx] = 0
+        self.exposed_ends[idx] = 0
+        self.exposed_double[idx] = 0
+        self.exposed_double_count[idx] = 0
+
+    def _advance(self, idx):
+        # Mirrors Spinner.play_until_need_agent_action
+        idx = idx[~self.game_done[idx]]
+        while idx.size:
+            self._draw_for_opening(idx[self.board_count[idx] == 0])
+            moved = self._play_turns(idx)
+            self._end_turns(moved)
+            idx = moved[~self.game_done[moved]]
+
+    def _draw_for_opening(self, idx):
+        """
+        Plays, in one go, the run of draws at the start of a round before a player holding an opening tile is to move.
+        Draws are uniform without replacement, so they are a random ordering of the boneyard dealt out in turn order.
+        The run ends at the first player who already holds an opening tile, or P turns after the first opening tile
+        is drawn, where P is the number of players.  At least one tile is left in the boneyard so no round ends here.
+        Without this a single game can hold up the lockstep loop for dozens of one-draw turns.
+        """
+        if not idx.size:
+            return
+        p = self.num_players
+        players = self.current_player[idx]
+        opening = self.opening_tiles[self.round[idx]]
+        holds = (self.hands[idx] & opening[:, None, :]).any(axis=2)
+        in_turn_order = (players[:, None] + np.arange(p)) % p
+        holds = holds[np.arange(idx.size)[:, None], in_turn_order]
+        first_holder = np.where(holds.any(axis=1), holds.argmax(axis=1), self.num_tiles)
+
+        bone = self.boneyard[idx]
+        order = np.argsort(np.where(bone, self.rng.random(bone.shape), 2.), axis=1)
+        bone_count = bone.sum(axis=1)
+        drawn_opening = opening[np.arange(idx.size)[:, None], order] & (np.arange(self.num_tiles) < bone_count[:, None])
+        first_drawn = np.where(drawn_opening.any(axis=1), drawn_opening.argmax(axis=1) + p, self.num_tiles)
+        num_draws = np.maximum(np.minimum(np.minimum(first_holder, first_drawn), bone_count - 1), 0)
+
+        draws = np.arange(self.num_tiles)[None, :] < num_draws[:, None]
+        rows = np.broadcast_to(idx[:, None], draws.shape)[draws]
+        drawers = ((players[:, None] + np.arange(self.num_tiles)) % p)[draws]
+        tiles = order[draws]
+        self.hands[rows, drawers, tiles] = True
+        self.boneyard[rows, tiles] = False
+        self.current_player[idx] = (players + num_draws) % p
+
+    def _usable_ends(self, idx):
+        # Mirrors Board.get_usable_exposed_ends as a (len(idx), num_ends) mask
+        usable = self.exposed_ends[idx] > 0
+        count = self.board_count[idx]
+        usable[count == 0] = False
+        early = np.flatnonzero((count == 1) | (count == 2))
+        usable[early] = False
+        usable[early, self.round[idx[early]]] = True
+        double = np.flatnonzero(self.exposed_double[idx] > 0)
+        usable[double] = False
+        usable[double, self.exposed_double[idx[double]]] = True
+        return usable
+
+    def _valid_play_counts(self, idx, players):
+        """
+        Mirrors Player.get_valid_plays for the current player of each game.
+        :return: counts[i, t], the number of valid play entries for tile t, and the usable ends mask
+        """
+        hand = self.hands[idx, players]
+        usable = self._usable_ends(idx)
+        counts = hand * (usable.astype(np.int16) @ self.end_multiplicity.T)
+        count = self.board_count[idx]
+        early = np.flatnonzero((count == 1) | (count == 2))
+        counts[early[:, None], self.double_tiles[None, :]] = 0
+        empty = np.flatnonzero(count == 0)
+        counts[empty] = hand[empty] & self.opening_tiles[self.round[idx[empty]]]
+        return counts, usable
+
+    def _playable_tiles(self, idx):
+        # (len(idx), num_tiles) mask of tiles that any player could play on each board
+        usable = self._usable_ends(idx)
+        playable = (usable.astype(np.int16) @ self.end_multiplicity.T) > 0
+        count = self.board_count[idx]
+        early = np.flatnonzero((count == 1) | (count == 2))
+        playable[early[:, None], self.double_tiles[None, :]] = False
+        empty = np.flatnonzero(count == 0)
+        playable[empty] = self.opening_tiles[self.round[idx[empty]]]
+        return playable
+
+    def _sample(self, weights):
+        # Picks one column per row with probability proportional to weights
+        cumulative = weights.cumsum(axis=1)
+        u = self.rng.random(weights.shape[0]) * cumulative[:, -1]
+        return (cumulative > u[:, None]).argmax(axis=1)
+
+    def _play_turns(self, idx, agent_codes=None):
+        """
+        Plays one turn for the current player of each game in idx, mirroring Player.play_turn.
+        :param idx: game indices
+        :param agent_codes: strategy codes for an agent move.  If None, the players' own strategies are used and
+                            games where the agent needs to choose an action are left unplayed.
+        :return: indices of the games where a turn was played
+        """
+        players = self.current_player[idx]
+        counts, usable = self._valid_play_counts(idx, players)
+        total = counts.sum(axis=1)
+
+        if agent_codes is None:
+            codes = self.strategy_codes[players]
+            played = ~((players == self.agent_seat) & (total >= 2))
+            idx, players, counts, usable, total, codes = (idx[played], players[played], counts[played],
+                                                          usable[played], total[played], codes[played])
+        else:
+            codes = np.asarray(agent_codes)
+
+        # No valid plays, draw a tile if the boneyard has one
+        draw = np.flatnonzero(total == 0)
+        draw = draw[self.boneyard[idx[draw]].any(axis=1)]
+        if draw.size:
+            keys = np.where(self.boneyard[idx[draw]], self.rng.random((draw.size, self.num_tiles)), -1.)
+            tiles = keys.argmax(axis=1)
+            self.boneyard[idx[draw], tiles] = False
+            self.hands[idx[draw], players[draw], tiles] = True
+
+        # Every entry of a tile has the tile's value, so the tile is chosen first and then one of its entries
+        play = np.flatnonzero(total > 0)
+        if play.size:
+            weights = counts[play]
+            codes = codes[play]
+            valid = weights > 0
+            high = np.flatnonzero(codes == STRATEGY_CODES['play_high'])
+            best = np.where(valid[high], self.tile_value, -1).max(axis=1)
+            weights[high] *= self.tile_value == best[:, None]
+            low = np.flatnonzero(codes == STRATEGY_CODES['play_low'])
+            best = np.where(valid[low], self.tile_value, np.iinfo(np.int64).max).min(axis=1)
+            weights[low] *= self.tile_value == best[:, None]
+            tiles = self._sample(weights)
+
+            games = idx[play]
+            ends = self._sample(self.end_multiplicity[tiles] * usable[play])
+            empty = self.board_count[games] == 0
+            ends[empty] = self.round[games[empty]]
+            self._place_tiles(games, players[play], tiles, ends)
+        return idx
+
+    def _place_tiles(self, idx, players, tiles, ends):
+        # Mirrors Player.place_tile_from_hand and Board.receive_tile
+        self.hands[idx, players, tiles] = False
+        count = self.board_count[idx]
+        self.board_count[idx] += 1
+        is_double = self.tile_is_double[tiles]
+        has_double = self.exposed_double[idx] > 0
+
+        first = count == 0
+        self.exposed_ends[idx[first], self.round[idx[first]]] = 2
+
+        early = (count == 1) | (count == 2)
+        on_double = (count > 2) & has_double
+        new_double = (count > 2) & ~has_double & is_double
+        adjust = early | (on_double & ~is_double) | ((count > 2) & ~has_double & ~is_double)
+
+        d = idx[on_double]
+        self.exposed_double_count[d] += 1
+        covered = d[self.exposed_double_count[d] == self.tiles_per_double]
+        self.exposed_double[covered] = 0
+        self.exposed_double_count[covered] = 0
+
+        self.exposed_double[idx[new_double]] = ends[new_double]
+        self.exposed_double_count[idx[new_double]] = 0
+
+        a = idx[adjust]
+        self.exposed_ends[a, ends[adjust]] -= 1
+        self.exposed_ends[a, self.other_end[tiles[adjust], ends[adjust]]] += 1
+        if np.any(self.exposed_ends[a] < 0):
+            raise Exception('VecSpinner.receive_tile error.  Tile played on end that is not exposed')
+
+        if self.allow_chickenfeet:
+            opened = idx[early & (count == 2)]
+            self.exposed_ends[opened, self.round[opened]] += 2
+
+    def _end_turns(self, idx):
+        # Mirrors Spinner.end_turn
+        players = self.current_player[idx]
+        hand_empty = ~self.hands[idx, players].any(axis=1)
+        blocked = np.flatnonzero(~hand_empty & ~self.boneyard[idx].any(axis=1))
+        round_done = hand_empty.copy()
+        if blocked.size:
+            playable = self._playable_tiles(idx[blocked])
+            round_done[blocked] = ~(self.hands[idx[blocked]] & playable[:, None, :]).any(axis=(1, 2))
+        self.current_player[idx] = (players + 1) % self.num_players
+
+        done = idx[round_done]
+        if not done.size:
+            return
+        scores = self.hands[done].astype(np.int64) @ self.tile_value
+        self.score_totals[done] += scores
+        self.game_done[done] = self.round[done] == self.ending_round
+
+        new_round = ~self.game_done[done]
+        done, scores = done[new_round], scores[new_round]
+        if done.size:
+            winners = scores == scores.min(axis=1, keepdims=True)
+            self.current_player[done] = self._sample(winners)
+            self.round[done] -= 1
+            self._deal(done)
+
+    def get_states(self):
+        match self.state_type:
+            case 'two_exposed_ends':
+                usable = self._usable_ends(np.arange(self.num_envs))
+                num_ends = usable.sum(axis=1)
+                if np.any(num_ends > 2):
+                    raise Exception(f'Invalid state type, must be two exposed ends')
+                low = usable.argmax(axis=1)
+                high = self.num_ends - 1 - usable[:, ::-1].argmax(axis=1)
+                return np.select([num_ends == 0, num_ends == 1], [110, 100 + low], low * 10 + high)
+            case 'one_state':
+                return np.zeros(self.num_envs, dtype=np.int64)
+            case _:
+                raise Exception(f'Invalid state type, {self.state_type} not defined.')
+
+    def get_num_actions(self):
+        return len(ACTION_KEYS[self.action_space_type])
+
+    def get_num_states(self):
+        match self.state_type:
+            case 'two_exposed_ends':
+                return 111
+            case 'one_state':
+                return 1
+            case _:
+                raise Exception('Invalid state type')
@@ -0,0 +1,125 @@
+"""
+This script contains the Zobrist hash of Spinner positions.
+
+A position is the set of tiles on the board, the count of each exposed end value, the exposed double and its count,
+every hand, the boneyard, the round and the seat to move.  Each of these facts has a random 64 bit key and the hash is
+the xor of the keys of the facts that hold, so a move changes the hash by xor-ing out the keys of the facts it ends
+and xor-ing in the keys of the facts it starts.  Board, Player and Spinner update the hash as they change the game,
+a full compute() is only done when a round is dealt or a snapshot is restored.
+
+The keys come from a fixed seed, so equal positions have equal hashes in every process.  The order of the tiles on
+the board and in the boneyard is not part of the position.
+"""
+from collections import Counter
+
+import numpy as np
+
+ZOBRIST_SEED = 0x5EED
+MAX_END_COUNT = 64
+
+
+class Zobrist:
+    """
+    Attributes:
+        value: hash of the current position
+        debug: if True, Spinner checks value against compute() after every turn
+    """
+
+    def __init__(self, game, debug=False):
+        tiles = game.tile_master
+        num_tiles, num_players = len(tiles), len(game.players)
+        end_values = list(range(game.max_pips + 1)) + ['S']
+        keys = iter(int(k) for k in np.random.default_rng(ZOBRIST_SEED).integers(
+            0, 2 ** 64, size=num_tiles * (num_players + 2) + len(end_values) * (MAX_END_COUNT + 1) +
+            len(end_values) + 1 + MAX_END_COUNT + game.max_pips + 1 + num_players, dtype=np.uint64))
+
+        # tile keys are indexed by Tile.id, the position of the tile in its TileSet
+        self.board_keys = [next(keys) for _ in range(num_tiles)]
+        self.boneyard_keys = [next(keys) for _ in range(num_tiles)]
+        self.hand_keys = [[next(keys) for _ in range(num_tiles)] for _ in range(num_players)]
+        # a count of 0 has key 0, so end values that are not exposed add nothing
+        self.end_keys = {v: [0] + [next(keys) for _ in range(MAX_END_COUNT)] for v in end_values}
+        self.double_keys = {v: next(keys) for v in end_values + [None]}
+        self.double_count_keys = [next(keys) for _ in range(MAX_END_COUNT)]
+        self.round_keys = [next(keys) for _ in range(game.max_pips + 1)]
+        self.move_keys = [next(keys) for _ in range(num_players)]
+        self.debug = debug
+        self.value = self.compute(game)
+
+    def compute(self, game) -> int:
+        """Hash of the position of game, computed from scratch"""
+        board = game.board
+        value = 0
+        for tile in board.tiles:
+            value ^= self.board_keys[tile.id]
+        for tile in game.boneyard:
+            value ^= self.boneyard_keys[tile.id]
+        for seat, player in enumerate(game.players):
+            keys = self.hand_keys[seat]
+            for tile in player.hand:
+                value ^= keys[tile.id]
+        for end, count in zip(board.end_values, board.end_counts):
+            value ^= self.end_keys[end][count]
+        value ^= self.double_keys[board.exposed_double]
+        value ^= self.double_count_keys[board.exposed_double_count]
+        value ^= self.round_keys[game.round]
+        value ^= self.move_keys[game.current_player.id]
+        return value
+
+    def reset(self, game) -> None:
+        self.value = self.compute(game)
+
+    def check(self, game) -> None:
+        expected = self.compute(game)
+        if self.value != expected:
+            raise Exception(f'Zobrist hash error, incremental hash {self.value:#018x} does not match '
+                            f'full recompute {expected:#018x}')
+
+    def toggle_board_tile(self, tile) -> None:
+        self.value ^= self.board_keys[tile.id]
+
+    def toggle_boneyard_tile(self, tile) -> None:
+        self.value ^= self.boneyard_keys[tile.id]
+
+    def toggle_hand_tile(self, player, tile) -> None:
+        self.value ^= self.hand_keys[player.id][tile.id]
+
+    def replace_end(self, removed, count_removed, added, count_added) -> None:
+        """
+        One exposed end removed replaced by added
+        :param count_removed, count_added: number of exposed ends of each value after the change
+        """
+        if removed == added:
+            return
+        keys_removed, keys_added = self.end_keys[removed], self.end_keys[added]
+        self.value ^= (keys_removed[count_removed + 1] ^ keys_removed[count_removed] ^
+                       keys_added[count_added - 1] ^ keys_added[count_added])
+
+    def change_ends(self, old_ends, new_ends) -> None:
+        for end, count in Counter(old_ends).items():
+            self.value ^= self.end_keys[end][count]
+        for end, count in Counter(new_ends).items():
+            self.value ^= self.end_keys[end][count]
+
+    def change_double(self, old_double, old_count, new_double, new_count) -> None:
+        self.value ^= (self.double_keys[old_double] ^ self.double_keys[new_double] ^
+                       self.double_count_keys[old_count] ^ self.double_count_keys[new_count])
+
+    def change_player(self, old_player, new_player) -> None:
+        self.value ^= self.move_keys[old_player.id] ^ self.move_keys[new_player.id]
+
+    def information_set_value(self, game, player) -> int:
+        """
+        Hash of the position as player sees it, the hash with the keys of the other hands and the boneyard taken out.
+        Positions that differ only in the hidden tiles have the same value, the number of hidden tiles in each place
+        is not part of it.
+        """
+        value = self.value
+        for seat, other in enumerate(game.players):
+            if other is not player:
+                keys = self.hand_keys[seat]
+                for tile in other.hand:
+                    value ^= keys[tile.id]
+        for tile in game.boneyard:
+            value ^= self.boneyard_keys[tile.id]
+        return value
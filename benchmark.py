@@ -0,0 +1,261 @@
+"""
+Throughput benchmarks for the Spinner engine.
+
+Measures, for every config in the matrix (max_pips x players x spinners):
+    games_per_sec, steps_per_sec: full games through Spinner.reset/execute_action with random agent actions
+    valid_plays_per_sec: uncached Player.find_valid_plays calls on positions from those games
+    learn_episodes_per_sec: QAgent.learn episodes
+
+Every metric times a fixed amount of work, --games games, --positions positions or --episodes episodes, on games
+seeded with --seed, so two runs on the same code do the same work.  Each config is run --repeats times, one pass over
+the matrix per repeat, and the median run is reported.  Chickenfeet is not in the matrix, Board does not play it yet.
+
+Results are written as JSON.  With --baseline, every metric is compared to a stored results file and the run exits
+with status 1 if any metric dropped by more than --threshold percent.  The comparison uses rates calibrated by a fixed
+piece of pure Python work timed next to every run, which cancels most of the speed differences of the machine between
+the two runs.
+
+    python benchmark.py --output bench.json --save-baseline benchmarks_baseline.json
+    python benchmark.py --baseline benchmarks_baseline.json --threshold 20
+"""
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+
+from Qagent import QAgent
+from Spinner import Spinner
+
+MAX_PIPS = [6, 9, 12]
+NUM_PLAYERS = [2, 3, 4, 5, 6]
+METRICS = ['games_per_sec', 'steps_per_sec', 'valid_plays_per_sec', 'learn_episodes_per_sec']
+
+
+def config_name(config):
+    return f'pips{config["max_pips"]}-players{config["num_players"]}-spinners{int(config["spinners"])}'
+
+
+def make_params(config):
+    """
+    Builds Spinner params for a benchmark config.  The hand size is cut so every player can be dealt from the smaller
+    sets.  The two_exposed_ends state only covers pips up to 9 and two ends, other configs use one_state.
+    """
+    num_tiles = (config['max_pips'] + 2 + config['spinners']) * (config['max_pips'] + 1 + config['spinners']) // 2
+    hand_size = min(7, num_tiles // (config['num_players'] + 1))
+    players = [{'id': 0, 'strategy': 'agent', 'verbose': False}]
+    players += [{'id': i, 'strategy': 'random', 'verbose': False} for i in range(1, config['num_players'])]
+    return {'max_pips': config['max_pips'],
+            'spinners': config['spinners'],
+            'allow_chickenfeet': False,
+            'initial_hand_size': hand_size,
+            'end_round': 0,
+            'state_type': 'two_exposed_ends' if config['max_pips'] <= 9 else 'one_state',
+            'action_space_type': 'hrl',
+            'players': players,
+            'verbose': False}
+
+
+def bench_games(game, num_games):
+    """:return: steps played and seconds taken by num_games full games"""
+    steps = 0
+    start = time.perf_counter()
+    for _ in range(num_games):
+        state, reward, done = game.reset()
+        while not done:
+            state, reward, done = game.execute_action(game.choice(range(game.get_num_actions())))
+            steps += 1
+    return steps, time.perf_counter() - start
+
+
+def bench_valid_plays(game, num_positions, calls_per_position=20):
+    """:return: find_valid_plays calls made and seconds taken by them on the first num_positions agent positions"""
+    calls = 0
+    elapsed = 0.
+    done = True
+    for _ in range(num_positions):
+        while done:
+            state, reward, done = game.reset()
+        start = time.perf_counter()
+        for player in game.players:
+            for _ in range(calls_per_position):
+                player.find_valid_plays()
+        elapsed += time.perf_counter() - start
+        calls += calls_per_position * len(game.players)
+        state, reward, done = game.execute_action(game.choice(range(game.get_num_actions())))
+    return calls, elapsed
+
+
+def bench_learn(game, episodes):
+    """:return: episodes learned and seconds taken by a new QAgent to learn them"""
+    agent = QAgent(game, verbose=False)
+    start = time.perf_counter()
+    agent.learn(episodes)
+    return episodes, time.perf_counter() - start
+
+
+def calibrate(n=40000):
+    """:return: seconds taken by a fixed piece of pure Python work that does not touch the engine"""
+    start = time.perf_counter()
+    table = {}
+    for i in range(n):
+        table[i % 97] = sorted((i % 13, i % 7, i % 11))
+    return time.perf_counter() - start
+
+
+# work key of each bench, see run_benchmarks
+BENCHES = [('games', bench_games), ('positions', bench_valid_plays), ('episodes', bench_learn)]
+# metrics of each work key, as (metric, per game work) with None for the work done by the bench
+BENCH_METRICS = {'games': [('games_per_sec', 'games'), ('steps_per_sec', None)],
+                 'positions': [('valid_plays_per_sec', None)],
+                 'episodes': [('learn_episodes_per_sec', None)]}
+
+
+def time_config(game, work, seed):
+    """
+    Runs every bench once on game, seeded with seed before each bench so every run does the same work.  calibrate()
+    is timed right before and after each bench, it slows down with the machine and the bench both.
+    :return: dict from work key to the bench's (work done, seconds, calibration seconds)
+    """
+    runs = {}
+    for key, bench in BENCHES:
+        before = calibrate()
+        game.seed(seed)
+        done, seconds = bench(game, work[key])
+        runs[key] = (done, seconds, (before + calibrate()) / 2)
+    return runs
+
+
+def config_result(config, work, runs):
+    """
+    :param runs: time_config results of the config
+    :return: result of the config.  Metrics are rates over the median run time.  calibrated holds the same rates per
+             second of calibrate() time, medians over the runs too, which is what compare_to_baseline compares.
+    """
+    result = {'name': config_name(config), 'config': config, 'calibrated': {}}
+    for key, metrics in BENCH_METRICS.items():
+        seconds = statistics.median(run[key][1] for run in runs)
+        relative = statistics.median(run[key][1] / run[key][2] for run in runs)
+        for metric, per in metrics:
+            done = work[per] if per is not None else runs[0][key][0]
+            result[metric] = done / seconds
+            result['calibrated'][metric] = done / relative
+    return result
+
+
+def run_benchmarks(configs, work, seed=0, repeats=5):
+    """
+    Times every config repeats times, one pass over all the configs per repeat, so a slow spell of the machine slows
+    one run of many configs rather than every run of one config.
+    :param work: dict with the number of games, positions and episodes each run times
+    """
+    games = {}
+    runs = {config_name(c): [] for c in configs}
+    errors = {}
+    for r in range(repeats):
+        print(f'Repeat {r + 1} of {repeats}')
+        for config in configs:
+            name = config_name(config)
+            if name in errors:
+                continue
+            try:
+                if name not in games:
+                    games[name] = Spinner(make_params(config))
+                runs[name].append(time_config(games[name], work, seed))
+            except Exception as e:  # report a failing config and keep going
+                errors[name] = f'{type(e).__name__}: {e}'
+
+    results = []
+    for config in configs:
+        name = config_name(config)
+        if name in errors:
+            result = {'name': name, 'config': config, 'error': errors[name]}
+            print(f'{name:45s} error {result["error"]}')
+        else:
+            result = config_result(config, work, runs[name])
+            print(f'{name:45s} ' + ' '.join(f'{m}={result[m]:.1f}' for m in METRICS))
+        results.append(result)
+    return {'meta': {'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'work': work,
+                     'repeats': repeats,
+                     'seed': seed,
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def compare_to_baseline(current, baseline, threshold):
+    """
+    Compares the calibrated rates of every metric, so a machine that is slower or busier than when the baseline was
+    taken does not show up as a regression.
+    :param threshold: allowed drop in percent
+    :return: list of regression messages, empty if every metric is within threshold of the baseline
+    """
+    regressions = []
+    current_by_name = {r['name']: r for r in current['results']}
+    for base in baseline['results']:
+        result = current_by_name.get(base['name'])
+        if result is None or 'error' in base:
+            continue
+        if 'error' in result:
+            regressions.append(f'{base["name"]}: now fails with {result["error"]}')
+            continue
+        for metric in METRICS:
+            if metric not in base.get('calibrated', {}):
+                continue
+            change = 100. * (result['calibrated'][metric] - base['calibrated'][metric]) / base['calibrated'][metric]
+            if change < -threshold:
+                regressions.append(f'{base["name"]} {metric}: {base[metric]:.1f} -> {result[metric]:.1f} '
+                                   f'({change:.1f}% calibrated)')
+    return regressions
+
+
+def build_configs(max_pips, num_players, spinners):
+    return [{'max_pips': p, 'num_players': n, 'spinners': s}
+            for p, n, s in itertools.product(max_pips, num_players, spinners)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Spinner engine throughput benchmarks')
+    parser.add_argument('--games', type=int, default=10, help='games timed per run for games and steps per second')
+    parser.add_argument('--positions', type=int, default=200, help='positions timed per run for valid plays')
+    parser.add_argument('--episodes', type=int, default=20, help='episodes timed per run for learning')
+    parser.add_argument('--repeats', type=int, default=5, help='runs per metric, the median is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-pips', type=int, nargs='+', default=MAX_PIPS)
+    parser.add_argument('--players', type=int, nargs='+', default=NUM_PLAYERS)
+    parser.add_argument('--spinners', type=int, nargs='+', choices=[0, 1], default=[0, 1])
+    parser.add_argument('--output', help='write results JSON to this file')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=20., help='allowed throughput drop in percent')
+    parser.add_argument('--save-baseline', help='also write results JSON to this file as the new baseline')
+    args = parser.parse_args(argv)
+
+    configs = build_configs(args.max_pips, args.players, [bool(s) for s in args.spinners])
+    work = {'games': args.games, 'positions': args.positions, 'episodes': args.episodes}
+    results = run_benchmarks(configs, work, args.seed, args.repeats)
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('work') != work or baseline['meta'].get('repeats') != args.repeats:
+            print(f'\nBaseline was measured with work {baseline["meta"].get("work")} and '
+                  f'{baseline["meta"].get("repeats")} repeats, rates may not be comparable')
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regressions beyond {args.threshold}%:')
+            for r in regressions:
+                print(f'  {r}')
+            return 1
+        print(f'\nNo regressions beyond {args.threshold}%')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
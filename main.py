@@ -1,8 +1,15 @@
-from Qagent import QAgent
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Qagent import BatchQAgent, QAgent
 from Spinner import Spinner
+from VecSpinner import VecSpinner
 import numpy as np
 from matplotlib import pyplot as plt
 
+# Spinner owned by this process, created once per worker by init_worker
+worker_game = None
+
 def main():
 
     STATE_SPACE_MODELS = {1: 'one_state',
@@ -24,7 +31,6 @@ def main():
     print('Initializing Spinner game with the following parameters:')
     print(params)
     print()
-    game = Spinner(params)
 
     NUM_AGENTS = 10
     NUM_EPISODES = 2000
@@ -32,14 +38,17 @@ def main():
     EPSILON = 0.2
     GAMMA = 0.93
     EPS_TO_ZERO_AT = 750
-    wins = [] # wins is a list of lists, [[0, 1, 0] ... [1, 1, 1]]
+    SEED = 0
+    NUM_WORKERS = min(NUM_AGENTS, os.cpu_count() or 1)
+    BATCHED = False # train all agents together with BatchQAgent on a VecSpinner instead of one QAgent each
+    agent_params = {'alpha': ALPHA, 'epsilon': EPSILON, 'gamma': GAMMA, 'eps_to_zero_at': EPS_TO_ZERO_AT}
     print(f'Training {NUM_AGENTS} agents for {NUM_EPISODES} episodes with alpha={ALPHA}, epsilon={EPSILON}, gamma={GAMMA}, eps_to_zero_at={EPS_TO_ZERO_AT}')
+    print(f'Using {NUM_WORKERS} workers, seed={SEED}')
     print()
-    for a in range(NUM_AGENTS):
-        agent = QAgent(game, alpha=ALPHA, epsilon=EPSILON, gamma=GAMMA, eps_to_zero_at=EPS_TO_ZERO_AT, verbose=False)
-        print(f'Agent {a} learning...')
-        wins.append(agent.learn(NUM_EPISODES))
-
+    if BATCHED:
+        wins = train_agents_batched(params, NUM_AGENTS, NUM_EPISODES, agent_params, SEED) # wins is a (NUM_AGENTS, NUM_EPISODES) array
+    else:
+        wins = train_agents(params, NUM_AGENTS, NUM_EPISODES, agent_params, SEED, NUM_WORKERS) # wins is a list of lists, [[0, 1, 0] ... [1, 1, 1]]
     print()
     print('Finished training agents, plotting...')
 
@@ -47,6 +56,54 @@ def main():
     plot_wins(params, wins, ROLLING_WINDOW, NUM_AGENTS, NUM_EPISODES, ALPHA, EPSILON, GAMMA, EPS_TO_ZERO_AT)
     
 
+def init_worker(params):
+    global worker_game
+    worker_game = Spinner(params)
+
+
+def train_agent(agent_index, seed, num_episodes, agent_params):
+    """
+    Trains one QAgent on this process's Spinner.  The Spinner is seeded first, so an agent trained with the same seed
+    gives the same wins in any worker.
+    :return: agent index and the agent's wins array
+    """
+    worker_game.seed(seed)
+    agent = QAgent(worker_game, verbose=False, **agent_params)
+    return agent_index, agent.learn(num_episodes)
+
+
+def train_agents(params, num_agents, num_episodes, agent_params, seed=0, num_workers=1):
+    """
+    Trains num_agents independent QAgents, agent a uses seed + a.  With num_workers > 1 the agents are spread over a
+    process pool and each worker has its own Spinner.  Results match a serial run with the same seed.
+    :return: list of wins arrays, ordered by agent
+    """
+    wins = [None] * num_agents
+    if num_workers == 1:
+        init_worker(params)
+        for a in range(num_agents):
+            print(f'Agent {a} learning...')
+            _, wins[a] = train_agent(a, seed + a, num_episodes, agent_params)
+        return wins
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=(params,)) as pool:
+        futures = [pool.submit(train_agent, a, seed + a, num_episodes, agent_params) for a in range(num_agents)]
+        for future in as_completed(futures):
+            a, wins[a] = future.result()
+            print(f'Agent {a} finished, win rate {wins[a].mean():.3f}')
+    return wins
+
+
+def train_agents_batched(params, num_agents, num_episodes, agent_params, seed=0):
+    """
+    Trains num_agents independent agents together, one VecSpinner game per agent.  The games differ from
+    train_agents with the same seed, the agents learn the same way.
+    :return: (num_agents, num_episodes) wins array
+    """
+    agent = BatchQAgent(VecSpinner(params, num_agents, seed), seed=seed, verbose=False, **agent_params)
+    return agent.learn(num_episodes)
+
+
 def plot_wins(params, wins, rolling_window, num_agents, num_episodes, alpha, epsilon, gamma, eps_to_zero_at):
     
     # for each agent, get the rolling average of wins